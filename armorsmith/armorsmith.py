@@ -3,14 +3,19 @@ from datetime import datetime
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
 from random import choice
-from collections import namedtuple, OrderedDict
+from collections import namedtuple, OrderedDict, defaultdict
+from bisect import bisect_left, bisect_right
 from copy import deepcopy
 from __main__ import send_cmd_help
 from .utils import checks
+from cogs.utils.chat_formatting import pagify, box
 import logging
 import os
+import asyncio
 
 
+default_settings = {"DUEL_HP": 100}
+
 
 class ArmorException(Exception):
     pass
@@ -36,6 +41,10 @@ class SameSenderAndReceiver(InventoryException):
     pass
 
 
+class StackFull(InventoryException):
+    pass
+
+
 class Item(namedtuple('Item', 'name cost')):
     @staticmethod
     def _roll_dice(dice):
@@ -73,201 +82,482 @@ class HealPotion(namedtuple('HealPotion', Item._fields + ('heal_dice',)), Item):
         return self._roll_dice(self.heal_dice)
 
 
+DEFAULT_STACK_SIZE = 99
+
+
+def item_slug(name):
+    return "_".join(name.casefold().split())
+
+
+def trigrams(text):
+    padded = "  {} ".format(text)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemCatalog:
+    def __init__(self, inventory, item_ids=None, stack_sizes=None):
+        """
+        Lookup structures over the store's items, built once per catalog: 
+        case insensitive names, a sorted name list for prefix search, 
+        trigrams for "did you mean" suggestions and per type cost ordering 
+        for price filters
+        :param inventory: {item type: [Item]}
+        :param item_ids: {item name: id stashes store the item under}, 
+        defaults to the lowercased name with spaces as underscores
+        :param stack_sizes: {item id: most of the item one stash holds}, 
+        defaults to DEFAULT_STACK_SIZE
+        """
+        item_ids = item_ids or {}
+        self.inventory = inventory
+        self.stack_sizes = stack_sizes or {}
+        self.by_name = {}
+        self.by_id = {}
+        self.ids = {}
+        self.types = {}
+        self.trigrams = defaultdict(set)
+        for item_type, items in inventory.items():
+            for item in items:
+                key = item.name.casefold()
+                item_id = item_ids.get(item.name) or item_slug(item.name)
+                self.by_name[key] = item
+                self.by_id[item_id] = item
+                self.ids[key] = item_id
+                self.types[key] = item_type
+                for trigram in trigrams(key):
+                    self.trigrams[trigram].add(key)
+        self.names = sorted(self.by_name)
+        self.by_cost = {}
+        for item_type, items in inventory.items():
+            ordered = sorted(items, key=lambda item: item.cost)
+            self.by_cost[item_type] = ([item.cost for item in ordered],
+                                       ordered)
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def get(self, name):
+        try:
+            return self.by_name[name.casefold()]
+        except KeyError:
+            raise ItemNotFound(name)
+
+    def item_id(self, item):
+        return self.ids[item.name.casefold()]
+
+    def stack_size(self, item_id):
+        return self.stack_sizes.get(item_id, DEFAULT_STACK_SIZE)
+
+    def describe(self, item_id):
+        item = self.by_id.get(item_id)
+        return item.name if item is not None else item_id
+
+    def with_prefix(self, prefix, limit=10):
+        prefix = prefix.casefold()
+        start = bisect_left(self.names, prefix)
+        found = []
+        for key in self.names[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            found.append(self.by_name[key])
+        return found
+
+    def suggest(self, name, limit=3):
+        """
+        :param name: misspelled item name
+        :param limit: most suggestions returned
+        :return: items whose names share the most trigrams with name, 
+        prefix matches first
+        """
+        found = self.with_prefix(name, limit)
+        query = trigrams(name.casefold())
+        shared = defaultdict(int)
+        for trigram in query:
+            for key in self.trigrams.get(trigram, ()):
+                shared[key] += 1
+        # dice coefficient, so long names don't win on length alone
+        scored = sorted(
+            ((2.0 * count / (len(query) + len(trigrams(key))), key)
+             for key, count in shared.items()), reverse=True)
+        for score, key in scored:
+            if len(found) >= limit or score < 0.3:
+                break
+            if self.by_name[key] not in found:
+                found.append(self.by_name[key])
+        return found
+
+    def filter(self, item_type=None, min_cost=None, max_cost=None):
+        """
+        :param item_type: one of the store's item types, None for all
+        :param min_cost: cheapest cost included, None for no lower bound
+        :param max_cost: most expensive cost included, None for no bound
+        :return: matching items ordered by cost within each type
+        """
+        if item_type is None:
+            item_types = list(self.by_cost)
+        elif item_type in self.by_cost:
+            item_types = [item_type]
+        else:
+            return []
+        found = []
+        for item_type in item_types:
+            costs, items = self.by_cost[item_type]
+            start = 0 if min_cost is None else bisect_left(costs, min_cost)
+            end = (len(costs) if max_cost is None
+                   else bisect_right(costs, max_cost))
+            found.extend(items[start:end])
+        return found
+
+
 class Inventory:
-    def __init__(self, bot, file_path):
+    def __init__(self, bot, vault, store):
+        """
+        Stashes of every user, kept as "armorsmith_stash" accounts in a vault
+        whose storage is {"stash": {item id: quantity}} referencing the 
+        store's catalog
+        :param bot: discord bot object
+        :param vault: VaultClass holding the stashes, shared with the bank so
+        purchases commit in one transaction
+        :param store: Store whose catalog resolves item ids
+        """
         self.bot = bot
-        self.accounts = dataIO.load_json(file_path)
+        self.vault = vault
+        self.store = store
+        self.account_name = "armorsmith_stash"
+
+    def import_json(self, file_path):
+        """
+        moves stashes saved by the old inventory json, 
+        {server:{user:{name, stash, created_at}}}, into the vault and renames
+        the file so it is only imported once
+        :param file_path: file path to the old inventory json
+        :return: 
+        """
+        if not dataIO.is_valid_json(file_path):
+            return
+        entries = []
+        for server_id, users in dataIO.load_json(file_path).items():
+            for user_id, account in users.items():
+                if not isinstance(account, dict) or "stash" not in account:
+                    # users_id from the old format without a server
+                    continue
+                stash = self._migrate_stash(account["stash"])
+                if stash is None:
+                    stash = account["stash"]
+                entries.append((server_id, user_id, self.account_name,
+                                {"metadata": {"name": account["name"],
+                                              "created_at":
+                                                  account["created_at"]},
+                                 "storage": {"stash": stash}}))
+        imported = self.vault.import_accounts(entries)
+        os.replace(file_path, file_path + ".migrated")
+        print("Imported {} stashes from {}".format(imported, file_path))
+
+    def _migrate_stash(self, stash):
+        """
+        converts a stash saved as {item name: item} to {item id: quantity}
+        :return: the converted stash, None if it already uses item ids
+        """
+        if all(isinstance(quantity, int) for quantity in stash.values()):
+            return None
+        catalog = self.store.catalog
+        migrated = {}
+        for name, quantity in stash.items():
+            if not isinstance(quantity, int):
+                quantity = 1
+            try:
+                item_id = catalog.item_id(catalog.get(name))
+            except ItemNotFound:
+                item_id = item_slug(name)
+            migrated[item_id] = migrated.get(item_id, 0) + quantity
+        return migrated
 
     def create_account(self, user):
-        server = user.server
-        if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts:  # Legacy account
-                stash = self.accounts[user.id]["stash"]
-            else:
-                stash = OrderedDict()
-            timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-            account = {"name": user.name,
-                       "stash": stash,
-                       "created_at": timestamp
-                       }
-            self.accounts[server.id][user.id] = account
-            self._save_inventory()
-            return self.get_account(user)
-        else:
+        try:
+            self.vault.create_account(user, account_name=self.account_name,
+                                      metadata={"name": user.name},
+                                      storage={"stash": {}})
+        except self.vault.AccountExistsExcpeption:
             raise AccountAlreadyExists()
+        return self.get_account(user)
 
     def account_exists(self, user):
+        return self.vault.account_exists(user, self.account_name)
+
+    def quantity(self, user, item):
+        stash = self.get_account(user).storage["stash"]
+        return stash.get(self.store.catalog.item_id(item), 0)
+
+    def has_item(self, user, item, quantity=1):
+        return self.quantity(user, item) >= quantity
+
+    def can_hold(self, user, item, quantity=1):
+        catalog = self.store.catalog
+        space = catalog.stack_size(catalog.item_id(item))
+        return self.quantity(user, item) + quantity <= space
+
+    def change_stash(self, transaction, user, item, change):
+        """
+        stages adding change (negative to remove) of item to the user's stash
+        :param transaction: VaultTransaction of the inventory's vault
+        :param user: discord member
+        :param item: Item from the store's catalog
+        :param change: quantity to add
+        :return: 
+        """
         try:
-            self._get_account(user)
-        except NoAccount:
-            return False
-        return True
-
-    def has_item(self, user, item):
-        account = self._get_account(user)
-        stash = account["stash"]
-        if item.name in stash.keys():
-            return True
-        else:
-            return False
-
-    def remove_item(self, user, item):
-        server = user.server
-        account = self._get_account(user)
-        stash = account["stash"]
-        if self.has_item(user, item):
-            del stash[item.name]
-            self.accounts[server.id][user.id] = account
-            self._save_inventory()
-        else:
+            account = transaction.get_account(user, self.account_name)
+        except self.vault.NoAccountException:
+            raise NoAccount()
+        stash = account["storage"]["stash"]
+        item_id = self.store.catalog.item_id(item)
+        quantity = stash.get(item_id, 0) + change
+        if quantity < 0:
             raise ItemNotFound()
+        if quantity > self.store.catalog.stack_size(item_id):
+            raise StackFull()
+        if quantity == 0:
+            stash.pop(item_id, None)
+        else:
+            stash[item_id] = quantity
+
+    def remove_item(self, user, item, quantity=1):
+        with self.vault.transaction() as transaction:
+            self.change_stash(transaction, user, item, -quantity)
 
-    def give_item(self, user, item):
-        server = user.server
-        account = self._get_account(user)
-        stash = account["stash"]
-        stash[item.name] = item
-        self.accounts[server.id][user.id] = account
-        self._save_inventory()
+    def give_item(self, user, item, quantity=1):
+        with self.vault.transaction() as transaction:
+            self.change_stash(transaction, user, item, quantity)
 
-    def transfer_item(self, sender, receiver, item):
+    def transfer_item(self, sender, receiver, item, quantity=1):
         if sender is receiver:
             raise SameSenderAndReceiver()
-        if self.account_exists(sender) and self.account_exists(receiver):
-            if not self.has_item(sender, item):
-                raise ItemNotFound()
-            self.remove_item(sender, item)
-            self.give_item(receiver, item)
-        else:
-            raise NoAccount()
+        with self.vault.transaction() as transaction:
+            self.change_stash(transaction, sender, item, -quantity)
+            self.change_stash(transaction, receiver, item, quantity)
 
     def wipe_inventories(self, server):
-        self.accounts[server.id] = {}
-        self._save_inventory()
+        self.vault.clear_server_accounts(server, self.account_name)
 
     def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
-        else:
-            return []
+        return self.vault.get_server_accounts(server, self.account_name)
 
     def get_all_accounts(self):
-        accounts = []
-        for server_id, v in self.accounts.items():
-            server = self.bot.get_server(server_id)
-            if server is None:
-                # Servers that have since been left will be ignored
-                # Same for users_id from the old bank format
-                continue
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-        return accounts
+        return [account for account in self.vault.get_all_accounts()
+                if account.name == self.account_name]
 
     def get_stash(self, user):
-        account = self._get_account(user)
-        return [str(x) for x in account["stash"]]
+        stash = self.get_account(user).storage["stash"]
+        catalog = self.store.catalog
+        return ["{} x{}".format(catalog.describe(item_id), quantity)
+                for item_id, quantity in stash.items()]
 
     def get_account(self, user):
-        acc = self._get_account(user)
-        acc["id"] = user.id
-        acc["server"] = user.server
-        return self._create_account_obj(acc)
-
-    def _create_account_obj(self, account):
-        account["member"] = account["server"].get_member(account["id"])
-        account["created_at"] = datetime.strptime(account["created_at"],
-                                                  "%Y-%m-%d %H:%M:%S")
-        Account = namedtuple("Account", "id name stash "
-                                        "created_at server member")
-        return Account(**account)
-
-    def _save_inventory(self):
-        dataIO.save_json("data/armorsmith/inventory.json", self.accounts)
-
-    def _get_account(self, user):
-        server = user.server
         try:
-            return deepcopy(self.accounts[server.id][user.id])
-        except KeyError:
+            return self.vault.get_account(user, self.account_name)
+        except self.vault.NoAccountException:
             raise NoAccount()
 
 
+def catalog_stamp(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_catalog(file_path):
+    """
+    reads the item json and indexes it, safe to run outside the event loop
+    :param file_path: item catalog json
+    :return: ItemCatalog
+    """
+    item_list = dataIO.load_json(file_path)
+    inventory = {"weapons": [],
+                 "armor": [],
+                 "potions": []}
+    item_ids = {}
+    stack_sizes = {}
+    for entries in item_list.values():
+        for entry in entries:
+            item_id = entry.get("id") or item_slug(entry["name"])
+            item_ids[entry["name"]] = item_id
+            if "stack_size" in entry:
+                stack_sizes[item_id] = entry["stack_size"]
+    for weapon in item_list.get("weapons_list", []):
+        inventory["weapons"].append(Weapon(
+            weapon["name"],
+            weapon["cost"],
+            weapon["hit_dice"]
+        ))
+    for armor in item_list.get("armor_list", []):
+        inventory["armor"].append(Armor(
+            armor["name"],
+            armor["cost"],
+            armor["damage_reduction"]
+        ))
+    for potion in item_list.get("potion_list", []):
+        inventory["potions"].append(HealPotion(
+            potion["name"],
+            potion["cost"],
+            potion["heal_dice"]
+        ))
+    return ItemCatalog(inventory, item_ids, stack_sizes)
+
+
+def embed_field_pages(lines, limit=1024):
+    """
+    :param lines: strings to show in an embed field
+    :param limit: most characters in one field value
+    :return: field values holding the lines in order, at least one
+    """
+    pages = []
+    page = ""
+    for line in lines:
+        line = line[:limit]
+        if page and len(page) + 1 + len(line) > limit:
+            pages.append(page)
+            page = ""
+        page = page + "\n" + line if page else line
+    pages.append(page or "None")
+    return pages
+
+
 class Store:
     """Interface to item list"""
 
-    def __init__(self, bot, file_path):
+    def __init__(self, bot, file_path, *, poll_interval=5):
+        """
+        :param bot: discord bot object
+        :param file_path: item catalog json, reloaded whenever it changes
+        :param poll_interval: seconds between checks of the catalog's mtime
+        """
         self.bot = bot
         self.file_path = file_path
-        self.inventory = {"weapons": [],
-                          "armor": [],
-                          "potions": []}
-        self._generate_inventory()
+        self.catalog_stamp = catalog_stamp(file_path)
+        self.catalog = load_catalog(file_path)
         self.dependencies = ["snakecogutils"]
+        self._embeds = None
+        self._load_dependencies()
+        self._watch_task = bot.loop.create_task(
+            self._watch_catalog(poll_interval))
 
-    def _generate_inventory(self):
-        item_list = dataIO.load_json(self.file_path)
-        for weapon in item_list["weapons_list"]:
-            self.inventory["weapons"].append(Weapon(
-                weapon["name"],
-                weapon["cost"],
-                weapon["hit_dice"]
-            ))
-        for armor in item_list["armor_list"]:
-            self.inventory["armor"].append(Armor(
-                armor["name"],
-                armor["cost"],
-                armor["damage_reduction"]
-            ))
-        for potion in item_list["potion_list"]:
-            self.inventory["potions"].append(HealPotion(
-                potion["name"],
-                potion["cost"],
-                potion["heal_dice"]
-            ))
+    @property
+    def inventory(self):
+        return self.catalog.inventory
 
-    def list_items(self):
-        self.bot.say(str(self.bot.cogs))
+    async def _watch_catalog(self, poll_interval):
+        try:
+            while True:
+                await asyncio.sleep(poll_interval)
+                stamp = catalog_stamp(self.file_path)
+                if stamp is None or stamp == self.catalog_stamp:
+                    continue
+                # a failed load waits for the next change of the file
+                self.catalog_stamp = stamp
+                try:
+                    catalog = await self.bot.loop.run_in_executor(
+                        None, load_catalog, self.file_path)
+                except (OSError, ValueError, KeyError) as exception:
+                    print("Could not reload {}: {}".format(self.file_path,
+                                                          exception))
+                    continue
+                # lookups in flight keep the catalog they started with
+                self.catalog = catalog
+                print("Reloaded {} items from {}".format(len(catalog),
+                                                         self.file_path))
+        except asyncio.CancelledError:
+            pass
+
+    def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    def _load_dependencies(self):
+        owner = self.bot.get_cog("Owner")
         for cogname in self.dependencies:
-            self.bot.get_cog("Owner")._load_cog("cogs."+cogname)
-        description = "What're ya buyin', PEN ISLAND traveler?" + self.bot.get_cog("TestBot").description
-        embed = discord.Embed(colour=0xFF0000, description=description)
-        embed.title = "Item Shop"
-        embed.set_author(name="Shopkeep", icon_url="http://imgur.com/zFYAFVg.jpg")
-        embed.add_field(name="Weapons", value='\n'.join([str(x) for x in self.inventory["weapons"]]))
-        embed.add_field(name="Armor", value='\n'.join([str(x) for x in self.inventory["armor"]]))
-        embed.add_field(name="Potions", value='\n'.join([str(x) for x in self.inventory["potions"]]))
-        embed.set_footer(text="Buy using [p]store buy <item name>")
-        return embed
+            if owner is None or "cogs." + cogname in self.bot.extensions:
+                continue
+            try:
+                owner._load_cog("cogs." + cogname)
+            except Exception as exception:
+                print("Could not load {} for the store: {}".format(cogname,
+                                                                  exception))
+
+    def list_items(self):
+        """
+        :return: the shop embeds, rendered once per catalog and reused until
+        the catalog is reloaded
+        """
+        catalog = self.catalog
+        if self._embeds is None or self._embeds[0] is not catalog:
+            self._embeds = (catalog, self._render_embeds(catalog))
+        return self._embeds[1]
+
+    def _render_embeds(self, catalog):
+        description = "What're ya buyin', PEN ISLAND traveler?"
+        dependency = self.bot.get_cog("TestBot")
+        if dependency is not None:
+            description += dependency.description
+        fields = []
+        for name, item_type in (("Weapons", "weapons"), ("Armor", "armor"),
+                                ("Potions", "potions")):
+            items = [str(x) for x in catalog.inventory[item_type]]
+            for index, page in enumerate(embed_field_pages(items)):
+                if index:
+                    fields.append(("{} (cont.)".format(name), page))
+                else:
+                    fields.append((name, page))
+        embeds = []
+        # embeds are capped at 25 fields and 6000 characters
+        while fields or not embeds:
+            embed = discord.Embed(colour=0xFF0000, description=description)
+            embed.title = "Item Shop"
+            embed.set_author(name="Shopkeep",
+                             icon_url="http://imgur.com/zFYAFVg.jpg")
+            embed.set_footer(text="Buy using [p]store buy <item name>")
+            size = len(description) + 100
+            count = 0
+            while fields and count < 25:
+                name, value = fields[0]
+                if count and size + len(name) + len(value) > 6000:
+                    break
+                embed.add_field(name=name, value=value)
+                size += len(name) + len(value)
+                count += 1
+                fields.pop(0)
+            embeds.append(embed)
+        return embeds
 
     def get_item_by_name(self, item_name):
-        for item_type in self.inventory.values():
-            for item in item_type:
-                if item.name == item_name:
-                    return item
-        raise ItemNotFound
+        return self.catalog.get(item_name)
+
+    def not_found_message(self, item_name):
+        suggestions = self.catalog.suggest(item_name)
+        if not suggestions:
+            return "The item specified does not exist."
+        return "The item specified does not exist. Did you mean {}?".format(
+            " or ".join(item.name for item in suggestions))
 
 
 class Armorsmith:
     def __init__(self, bot):
         self.bot = bot
-        self.inventory = Inventory(bot, "data/armorsmith/inventory.json")
+        self.bank = self.bot.get_cog("Bank")
+        self.vault = bot.get_cog("Vault").get_vault(self.bank.vault_directory,
+                                                    self.bank.vault_path,
+                                                    "Armorsmith")
         self.store = Store(bot, "data/armorsmith/items.json")
-        self.bank = self.bot.get_cog("Economy").bank
+        self.inventory = Inventory(bot, self.vault, self.store)
+        self.inventory.import_json("data/armorsmith/inventory.json")
         self.file_path = "data/armorsmith/settings.json"
-        self.settings = dataIO.load_json(self.file_path)
+        self.settings = bot.get_cog("Vault").get_settings(
+            "data/armorsmith", self.file_path, default_settings)
+
+    def __unload(self):
+        self.store.stop_watching()
+        self.settings.close()
 
     @commands.group(name="inventory", pass_context=True)
     async def _inventory(self, ctx):
@@ -293,22 +583,23 @@ class Armorsmith:
         if not user:
             user = ctx.message.author
             try:
-                await self.bot.say("{} Your stash contains: {}".format(user.mention, self.inventory.get_stash(user)))
+                await self.bot.say("{} Your stash contains: {}".format(user.mention, ", ".join(self.inventory.get_stash(user)) or "nothing"))
             except NoAccount:
                 await self.bot.say(
                     "{} You don't have a stash with the Armorsmith. Type `{}inventory register` to open one".format(
                         user.mention, ctx.prefix))
         else:
             try:
-                await self.bot.say("{}'s stash is {}".format(user.name, self.inventory.get_stash(user)))
+                await self.bot.say("{}'s stash is {}".format(user.name, ", ".join(self.inventory.get_stash(user)) or "empty"))
             except NoAccount:
                 await self.bot.say("That user has no inventory stash")
 
     @_inventory.command(pass_context=True)
-    async def transfer(self, ctx, user: discord.Member, item: Item):
+    async def transfer(self, ctx, user: discord.Member, *, item_name: str):
         """Transfers an item to other users."""
         author = ctx.message.author
         try:
+            item = self.store.get_item_by_name(item_name)
             self.inventory.transfer_item(author, user, item)
             logger.info(
                 "{} ({}) transferred {} to {}({})".format(author.name, author.id, item.name, user.name, user.id))
@@ -317,6 +608,8 @@ class Armorsmith:
             await self.bot.say("You can't transfer to yourself.")
         except ItemNotFound:
             await self.bot.say("Item was not found in your stash.")
+        except StackFull:
+            await self.bot.say("{} can't carry any more of that item.".format(user.name))
         except NoAccount:
             await self.bot.say("That user has no stash account.")
 
@@ -331,7 +624,11 @@ class Armorsmith:
             logger.info("{}({}) gave {} to {}({})".format(author.name, author.id, item_obj.name, user.name, user.id))
             await self.bot.say("{} has been given to {}".format(item_obj.name, user.name))
         except ItemNotFound:
-            await self.bot.say("Item name does not exist")
+            await self.bot.say(self.store.not_found_message(item_name))
+        except StackFull:
+            await self.bot.say("{} can't carry any more of that item.".format(user.name))
+        except NoAccount:
+            await self.bot.say("That user has no stash account.")
 
     @_inventory.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -354,8 +651,8 @@ class Armorsmith:
     @_store.command(pass_context=True, no_pm=False)
     async def list(self, ctx):
         """Lists all available items for purchase"""
-        embed = self.store.list_items()
-        await self.bot.whisper(embed=embed)
+        for embed in self.store.list_items():
+            await self.bot.whisper(embed=embed)
 
     @_store.command(pass_context=True, no_pm=True)
     async def buy(self, ctx, *, item_name):
@@ -363,12 +660,40 @@ class Armorsmith:
         author = ctx.message.author
         try:
             item = self.store.get_item_by_name(item_name)
-            self.bank.withdraw_credits(author, item.cost)
-            self.inventory.give_item(author, item)
+            # the debit and the stash change commit together or not at all
+            with self.vault.transaction() as transaction:
+                self.inventory.change_stash(transaction, author, item, 1)
+                self.bank.withdraw_credits(author, item.cost,
+                                           transaction=transaction)
+            logger.info("{}({}) bought {} for {}".format(author.name, author.id, item.name, item.cost))
+            await self.bot.say("{} bought {} for {} credits.".format(author.mention, item.name, item.cost))
+        except self.bank.NoAccount:
+            await self.bot.say("You need a bank account to buy items. Type `{}bank register` to open one.".format(ctx.prefix))
+        except self.bank.InsufficientBalance:
+            await self.bot.say("You can't afford that item.")
+        except StackFull:
+            await self.bot.say("Your stash can't hold any more of that item.")
         except NoAccount:
             await self.bot.say("You do not have a stash register. Please do so before buying.")
         except ItemNotFound:
-            await self.bot.say("The item specified does not exist.")
+            await self.bot.say(self.store.not_found_message(item_name))
+
+    @_store.command(pass_context=True)
+    async def search(self, ctx, item_type: str = None, min_cost: int = None,
+                     max_cost: int = None):
+        """Lists items of a type within a price range
+
+        Type is one of weapons, armor or potions, or all."""
+        if item_type == "all":
+            item_type = None
+        items = self.store.catalog.filter(item_type, min_cost, max_cost)
+        if not items:
+            await self.bot.say("No items match.")
+            return
+        msg = "\n".join("{} ({} credits)".format(item.name, item.cost)
+                        for item in items)
+        for page in pagify(msg):
+            await self.bot.say(box(page))
 
     # TODO: Add battles, battle-leaderboards, betting
 
@@ -378,17 +703,12 @@ class Armorsmith:
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
 
-    @_fight.command(pass_contex=True, no_pm=True)
+    @_fight.command(pass_context=True, no_pm=True)
     async def duel(self, ctx, user: discord.User):
         author = ctx.message.author
-        hp_author = 100
-        hp_user = 100
-
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
+        settings = self.settings[author.server.id]
+        hp_author = settings.DUEL_HP
+        hp_user = settings.DUEL_HP
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_server=True)
@@ -404,6 +724,15 @@ class Armorsmith:
             await send_cmd_help(ctx)
             await self.bot.say(msg)
 
+    @armorsmithset.command(pass_context=True)
+    async def duelhp(self, ctx, hp: int):
+        """Hit points each fighter starts a duel with"""
+        server = ctx.message.server
+        if hp < 1:
+            hp = 1
+        self.settings.set(server.id, "DUEL_HP", hp)
+        await self.bot.say("Duels now start with {} hit points.".format(hp))
+
     def display_time(self, seconds, granularity=2):
         intervals = (  # Source: http://stackoverflow.com/a/24542445
             ('weeks', 604800),  # 60 * 60 * 24 * 7
@@ -437,11 +766,6 @@ def check_files():
         print("Creating default armorsmith settings.json...")
         dataIO.save_json(f, {})
 
-    f = "data/armorsmith/inventory.json"
-    if not dataIO.is_valid_json(f):
-        print("Creating empty inventory.json...")
-        dataIO.save_json(f, {})
-
     f = "data/armorsmith/items.json"
     if not dataIO.is_valid_json(f):
         print("Item file not found/invalid. Creating blank item file")
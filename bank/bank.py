@@ -7,13 +7,52 @@ from copy import deepcopy
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
 from enum import Enum
+from itertools import product
 from __main__ import send_cmd_help
 import os
 import time
 import logging
 import random
+import math
 import asyncio
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+default_settings = {"PAYDAY_TIME": 300, "PAYDAY_CREDITS": 120,
+                    "SLOT_MIN": 5, "SLOT_MAX": 100, "SLOT_TIME": 0,
+                    "REGISTER_CREDITS": 0}
+
+
+class BankError(Exception):
+    pass
+
+
+class NoAccount(BankError):
+    pass
+
+
+class InsufficientBalance(BankError):
+    pass
+
+
+class NegativeValue(BankError):
+    pass
+
+
+class SameSenderAndReceiver(BankError):
+    pass
+
+
+class OnCooldown(BankError):
+    pass
+
+
+class InvalidBid(BankError):
+    pass
+
 
 class SetParser:
     def __init__(self, argument):
@@ -37,29 +76,226 @@ class SetParser:
             raise
 
 
+class SMReel(Enum):
+    cherries = "\N{CHERRIES}"
+    cookie = "\N{COOKIE}"
+    two = "\N{DIGIT TWO}\N{COMBINING ENCLOSING KEYCAP}"
+    flc = "\N{FOUR LEAF CLOVER}"
+    cyclone = "\N{CYCLONE}"
+    sunflower = "\N{SUNFLOWER}"
+    six = "\N{DIGIT SIX}\N{COMBINING ENCLOSING KEYCAP}"
+    mushroom = "\N{MUSHROOM}"
+    heart = "\N{HEAVY BLACK HEART}"
+    snowflake = "\N{SNOWFLAKE}"
+
+
+PAYOUTS = {
+    (SMReel.two, SMReel.two, SMReel.six): {
+        "payout": lambda x: x * 2500 + x,
+        "phrase": "JACKPOT! 226! Your bid has been multiplied * 2500!"
+    },
+    (SMReel.flc, SMReel.flc, SMReel.flc): {
+        "payout": lambda x: x + 1000,
+        "phrase": "4LC! +1000!"
+    },
+    (SMReel.cherries, SMReel.cherries, SMReel.cherries): {
+        "payout": lambda x: x + 800,
+        "phrase": "Three cherries! +800!"
+    },
+    (SMReel.two, SMReel.six): {
+        "payout": lambda x: x * 4 + x,
+        "phrase": "2 6! Your bid has been multiplied * 4!"
+    },
+    (SMReel.cherries, SMReel.cherries): {
+        "payout": lambda x: x * 3 + x,
+        "phrase": "Two cherries! Your bid has been multiplied * 3!"
+    },
+    "3 symbols": {
+        "payout": lambda x: x + 500,
+        "phrase": "Three symbols! +500!"
+    },
+    "2 symbols": {
+        "payout": lambda x: x * 2 + x,
+        "phrase": "Two consecutive symbols! Your bid has been multiplied * 2!"
+    },
+}
+
+SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
+                    "{two.value} {two.value} {six.value} Bet * 2500\n"
+                    "{flc.value} {flc.value} {flc.value} +1000\n"
+                    "{cherries.value} {cherries.value} {cherries.value} +800\n"
+                    "{two.value} {six.value} Bet * 4\n"
+                    "{cherries.value} {cherries.value} Bet * 3\n\n"
+                    "Three symbols: +500\n"
+                    "Two symbols: Bet * 2".format(**SMReel.__members__))
+
+
+def find_payout(line):
+    """
+    :param line: the three symbols on the middle row
+    :return: PAYOUTS key the line wins, None if it wins nothing
+    """
+    if line in PAYOUTS:
+        return line
+    # Checks for two-consecutive-symbols special rewards
+    for pair in (line[:2], line[1:]):
+        if pair in PAYOUTS:
+            return pair
+    # Still nothing. Let's check for 3 generic same symbols
+    # or 2 consecutive symbols
+    if line[0] == line[1] == line[2]:
+        return "3 symbols"
+    if line[0] == line[1] or line[1] == line[2]:
+        return "2 symbols"
+    return None
+
+
+def build_slot_table(reel):
+    """
+    precomputes every pull. Each of the three reels shows 3 consecutive 
+    symbols starting at a uniformly random offset, so a pull is fully 
+    described by offset0 * len(reel) ** 2 + offset1 * len(reel) + offset2 
+    :param reel: symbols in reel order
+    :return: (slot texts, payout keys) lists indexed by pull, and the 
+    distinct payout keys in order with None (no win) last
+    """
+    size = len(reel)
+    texts = []
+    payouts = []
+    for offsets in product(range(size), repeat=3):
+        rows = [[reel[(offset + row) % size] for offset in offsets]
+                for row in range(3)]
+        slot = "~~\n~~"  # Mobile friendly
+        for i, row in enumerate(rows):  # Let's build the slot to show
+            sign = "  "
+            if i == 1:
+                sign = ">"
+            slot += "{}{} {} {}\n".format(sign, *[c.value for c in row])
+        texts.append(slot)
+        payouts.append(find_payout(tuple(rows[1])))
+    return texts, payouts, list(PAYOUTS) + [None]
+
+
+SLOT_TEXTS, SLOT_PAYOUTS, SLOT_PAYOUT_KEYS = build_slot_table(list(SMReel))
+
+
+def simulate_slots(pulls, bids):
+    """
+    plays pulls random pulls with numpy and prices them at every bid
+    :param pulls: number of pulls to simulate
+    :param bids: bids to report on
+    :return: list of (bid, simulated return per credit bid, exact return 
+    per credit bid)
+    """
+    classes = numpy.array([SLOT_PAYOUT_KEYS.index(key)
+                           for key in SLOT_PAYOUTS])
+    exact = numpy.bincount(classes, minlength=len(SLOT_PAYOUT_KEYS))
+    drawn = classes[numpy.random.randint(0, len(classes), size=pulls)]
+    counts = numpy.bincount(drawn, minlength=len(SLOT_PAYOUT_KEYS))
+    results = []
+    for bid in bids:
+        pays = numpy.array([PAYOUTS[key]["payout"](bid) if key else 0
+                            for key in SLOT_PAYOUT_KEYS], dtype=numpy.float64)
+        results.append((bid,
+                        numpy.dot(counts, pays) / (pulls * bid),
+                        numpy.dot(exact, pays) / (len(classes) * bid)))
+    return results
+
+
 class Bank:
     """Economy
     Get rich and have fun with imaginary currency!"""
 
     def __init__(self, bot):
-        global default_settings
         self.bot = bot
-        self.bank = Bank(bot, "data/economy/bank.json")
+        self.BankError = BankError
+        self.NoAccount = NoAccount
+        self.InsufficientBalance = InsufficientBalance
         self.vault_path = "data/vault/bank.json"
         self.vault_directory = "data/vault"
         self.vault = bot.get_cog("Vault").get_vault(self.vault_directory,
                                                     self.vault_path,
                                                     "Bank")
         self.settings_path = self.vault_directory + "/bank_settings.json"
-        self.settings = dataIO.load_json(self.settings_path)
-        self.settings = defaultdict(lambda: default_settings, self.settings)
-        self.payday_register = defaultdict(dict)
-        self.slot_register = defaultdict(dict)
+        self.settings = bot.get_cog("Vault").get_settings(
+            self.vault_directory, self.settings_path, default_settings)
+        self.cooldowns = bot.get_cog("Vault").get_cooldowns(
+            self.vault_directory,
+            self.vault_directory + "/bank_cooldowns.json")
         self.account_name = "basic_bank_account"
+        self.balance_index = self.vault.add_index(
+            "balance", self.account_name,
+            lambda account: account["storage"].get("balance", 0))
+        self.balance_columns = None
+        if numpy is not None:
+            self.balance_columns = self.vault.add_column_index(
+                "balance_columns", self.account_name,
+                lambda account: account["storage"].get("balance", 0))
+        # server id -> {"YYYY-MM-DD": payday credits issued}, since load
+        self.payday_totals = defaultdict(lambda: defaultdict(int))
+
+    def __unload(self):
+        # the stores outlive a reload, the next Bank gets them back
+        self.cooldowns.close()
+        self.settings.close()
 
     def _get_balance(self, user):
-        return self.vault.get_account(user, self.account_name)["storage"][
-            "balance"]
+        try:
+            return self.vault.get_account(user, self.account_name)[
+                "storage"]["balance"]
+        except self.vault.NoAccountException:
+            raise NoAccount()
+
+    def _account_lock(self, *users):
+        return self.vault.lock(*[(user, self.account_name) for user in users])
+
+    def _can_spend(self, user, amount):
+        return self._get_balance(user) >= amount
+
+    def _set_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        try:
+            with self.vault.transaction() as transaction:
+                account = transaction.get_account(user, self.account_name)
+                account["storage"]["balance"] = amount
+        except self.vault.NoAccountException:
+            raise NoAccount()
+
+    def _deposit_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        self._set_credits(user, self._get_balance(user) + amount)
+
+    def _withdraw_credits(self, user, amount):
+        if amount < 0:
+            raise NegativeValue()
+        balance = self._get_balance(user)
+        if balance < amount:
+            raise InsufficientBalance()
+        self._set_credits(user, balance - amount)
+
+    def withdraw_credits(self, user, amount, *, transaction=None):
+        """
+        withdraws credits for other cogs sharing the bank's vault
+        :param user: discord member paying
+        :param amount: credits to withdraw
+        :param transaction: VaultTransaction of the bank's vault to stage the
+        withdrawal in, so it commits with the caller's other changes
+        :return: 
+        """
+        if transaction is None:
+            self._withdraw_credits(user, amount)
+            return
+        if amount < 0:
+            raise NegativeValue()
+        try:
+            account = transaction.get_account(user, self.account_name)
+        except self.vault.NoAccountException:
+            raise NoAccount()
+        if account["storage"]["balance"] < amount:
+            raise InsufficientBalance()
+        account["storage"]["balance"] -= amount
 
     @commands.group(name="bank", pass_context=True)
     async def _bank(self, ctx):
@@ -70,13 +306,18 @@ class Bank:
     @_bank.command(pass_context=True, no_pm=True)
     async def register(self, ctx):
         """Registers an account at the Twentysix bank"""
-        settings = self.settings.get(ctx.message.server.id, {})
         author = ctx.message.author
-        balance = settings.get("REGISTER_CREDITS", 0)
+        balance = self.settings[author.server.id].REGISTER_CREDITS
         metadata = {"id": author.id, "permissionlevel": 0}
         storage = {"balance": balance}
-        account = self.vault.create_account(author, self.account_name, metadata,
-                                            storage)
+        try:
+            account = self.vault.create_account(
+                author, account_name=self.account_name, metadata=metadata,
+                storage=storage)
+        except self.vault.AccountExistsExcpeption:
+            await self.bot.say("{} You already have an account at the"
+                               " Twentysix bank.".format(author.mention))
+            return
         await self.bot.say("{} Account opened. Current balance: {}"
                            "".format(author.mention,
                                      account["storage"]["balance"]))
@@ -90,7 +331,7 @@ class Bank:
             try:
                 await self.bot.say("{} Your balance is: {}".format(
                     user.mention, self._get_balance(user)))
-            except self.vault.AccountExistsExcpeption:
+            except NoAccount:
                 await self.bot.say("{} You don't have an account at the"
                                    " Twentysix bank. Type `{}bank register`"
                                    " to open one.".format(user.mention,
@@ -99,17 +340,41 @@ class Bank:
             try:
                 await self.bot.say("{}'s balance is {}".format(
                     user.name, self._get_balance(user)))
-            except self.vault.AccountExistsExcpeption:
+            except NoAccount:
                 await self.bot.say("That user has no bank account.")
 
-    _transfer
+    def _transfer_credits(self, sender, receiver, amount):
+        """
+        moves credits between two bank accounts in a single vault transaction
+        :param sender: discord member sending credits
+        :param receiver: discord member receiving credits
+        :param amount: credits to move
+        :return: 
+        """
+        if amount < 1:
+            raise NegativeValue()
+        if sender.id == receiver.id:
+            raise SameSenderAndReceiver()
+        try:
+            with self.vault.transaction() as transaction:
+                send_account = transaction.get_account(sender,
+                                                       self.account_name)
+                recv_account = transaction.get_account(receiver,
+                                                       self.account_name)
+                if send_account["storage"]["balance"] < amount:
+                    raise InsufficientBalance()
+                send_account["storage"]["balance"] -= amount
+                recv_account["storage"]["balance"] += amount
+        except self.vault.NoAccountException:
+            raise NoAccount()
 
     @_bank.command(pass_context=True)
     async def transfer(self, ctx, user: discord.Member, sum: int):
         """Transfer credits to other users"""
         author = ctx.message.author
         try:
-            self.bank.transfer_credits(author, user, sum)
+            async with self._account_lock(author, user):
+                self._transfer_credits(author, user, sum)
             logger.info("{}({}) transferred {} credits to {}({})".format(
                 author.name, author.id, sum, user.name, user.id))
             await self.bot.say("{} credits have been transferred to {}'s"
@@ -123,6 +388,39 @@ class Bank:
         except NoAccount:
             await self.bot.say("That user has no bank account.")
 
+    def _apply_credits(self, members, credits):
+        """
+        applies a SetParser operation to the bank accounts of many members in
+        one vault transaction, members without an account or without enough
+        credits for a withdraw are skipped
+        :param members: discord members to update
+        :param credits: SetParser
+        :return: (updated, no_account, insufficient) lists of members
+        """
+        updated, no_account, insufficient = [], [], []
+        with self.vault.transaction() as transaction:
+            for member in members:
+                try:
+                    account = transaction.get_account(member,
+                                                      self.account_name)
+                except self.vault.NoAccountException:
+                    no_account.append(member)
+                    continue
+                balance = account["storage"]["balance"]
+                if credits.operation == "deposit":
+                    balance += credits.sum
+                elif credits.operation == "withdraw":
+                    balance -= credits.sum
+                else:
+                    balance = credits.sum
+                if balance < 0:
+                    transaction.discard(member, self.account_name)
+                    insufficient.append(member)
+                    continue
+                account["storage"]["balance"] = balance
+                updated.append(member)
+        return updated, no_account, insufficient
+
     @_bank.command(name="set", pass_context=True)
     @checks.admin_or_permissions(manage_server=True)
     async def _set(self, ctx, user: discord.Member, credits: SetParser):
@@ -134,20 +432,24 @@ class Bank:
             bank set @Twentysix -6 - Removes 6 credits"""
         author = ctx.message.author
         try:
+            async with self._account_lock(user):
+                updated, no_account, insufficient = self._apply_credits(
+                    [user], credits)
+            if no_account:
+                raise NoAccount()
+            if insufficient:
+                raise InsufficientBalance()
             if credits.operation == "deposit":
-                self.bank.deposit_credits(user, credits.sum)
                 logger.info("{}({}) added {} credits to {} ({})".format(
                     author.name, author.id, credits.sum, user.name, user.id))
                 await self.bot.say("{} credits have been added to {}"
                                    "".format(credits.sum, user.name))
             elif credits.operation == "withdraw":
-                self.bank.withdraw_credits(user, credits.sum)
                 logger.info("{}({}) removed {} credits to {} ({})".format(
                     author.name, author.id, credits.sum, user.name, user.id))
                 await self.bot.say("{} credits have been withdrawn from {}"
                                    "".format(credits.sum, user.name))
             elif credits.operation == "set":
-                self.bank.set_credits(user, credits.sum)
                 logger.info("{}({}) set {} credits to {} ({})"
                             "".format(author.name, author.id, credits.sum,
                                       user.name, user.id))
@@ -158,6 +460,75 @@ class Bank:
         except NoAccount:
             await self.bot.say("User has no bank account.")
 
+    async def _bulk_set(self, ctx, members, credits, target):
+        author = ctx.message.author
+        # one pass over the server's accounts, only holders get locked
+        holders = set(account.userid for account in
+                      self.vault.get_server_accounts(ctx.message.server,
+                                                     self.account_name))
+        no_account = [member for member in members
+                      if member.id not in holders]
+        members = [member for member in members if member.id in holders]
+        async with self._account_lock(*members):
+            updated, closed, insufficient = self._apply_credits(members,
+                                                                credits)
+        no_account += closed
+        verb = {"deposit": "added {} credits to",
+                "withdraw": "removed {} credits from",
+                "set": "set {} credits for"}[credits.operation]
+        verb = verb.format(credits.sum)
+        if updated:
+            logger.info("{}({}) {} {} accounts ({}):\n{}".format(
+                author.name, author.id, verb, len(updated), target,
+                "\n".join("{} ({})".format(member.name, member.id)
+                          for member in updated)))
+        msg = "{} {} bank accounts ({}).".format(verb.capitalize(),
+                                                 len(updated), target)
+        if no_account:
+            msg += "\n{} members have no bank account.".format(
+                len(no_account))
+        if insufficient:
+            msg += "\n{} members didn't have enough credits.".format(
+                len(insufficient))
+        await self.bot.say(msg)
+
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def setmany(self, ctx, credits: SetParser, *users: discord.Member):
+        """Sets credits of every mentioned user's bank account at once
+        Takes the same +/- operations as bank set
+        Example:
+            bank setmany +100 @Twentysix @Irdumb"""
+        if not users:
+            await send_cmd_help(ctx)
+            return
+        await self._bulk_set(ctx, set(users), credits, "mentioned users")
+
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def setrole(self, ctx, role: discord.Role, credits: SetParser):
+        """Sets credits of every bank account holder with a role at once
+        Takes the same +/- operations as bank set
+        Example:
+            bank setrole Moderators +100"""
+        server = ctx.message.server
+        if role.is_everyone:
+            members = list(server.members)
+        else:
+            members = [member for member in server.members
+                       if role in member.roles]
+        await self._bulk_set(ctx, members, credits, role.name)
+
+    @_bank.command(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def setall(self, ctx, credits: SetParser):
+        """Sets credits of every bank account on the server at once
+        Takes the same +/- operations as bank set
+        Example:
+            bank setall +100"""
+        server = ctx.message.server
+        await self._bulk_set(ctx, list(server.members), credits, "everyone")
+
     @_bank.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
     async def reset(self, ctx, confirmation: bool = False):
@@ -167,7 +538,8 @@ class Bank:
                                "this server.\nIf you're sure, type "
                                "{}bank reset yes".format(ctx.prefix))
         else:
-            self.bank.wipe_bank(ctx.message.server)
+            self.vault.clear_server_accounts(ctx.message.server,
+                                             self.account_name)
             await self.bot.say("All bank accounts of this server have been "
                                "deleted.")
 
@@ -177,34 +549,23 @@ class Bank:
         author = ctx.message.author
         server = author.server
         id = author.id
-        if self.bank.account_exists(author):
-            if id in self.payday_register[server.id]:
-                seconds = abs(self.payday_register[server.id][
-                                  id] - int(time.perf_counter()))
-                if seconds >= self.settings[server.id]["PAYDAY_TIME"]:
-                    self.bank.deposit_credits(author, self.settings[
-                        server.id]["PAYDAY_CREDITS"])
-                    self.payday_register[server.id][
-                        id] = int(time.perf_counter())
+        if self.vault.account_exists(author, self.account_name):
+            async with self._account_lock(author):
+                settings = self.settings[server.id]
+                credits = settings.PAYDAY_CREDITS
+                remaining = self.cooldowns.try_start(
+                    ("payday", server.id, id), settings.PAYDAY_TIME)
+                if remaining == 0:
+                    self._deposit_credits(author, credits)
+                    self._record_payday(server, credits)
                     await self.bot.say(
-                        "{} Here, take some credits. Enjoy! (+{}"
-                        " credits!)".format(
-                            author.mention,
-                            str(self.settings[server.id]["PAYDAY_CREDITS"])))
+                        "{} Here, take some credits. Enjoy! (+{} credits!)"
+                        "".format(author.mention, str(credits)))
                 else:
-                    dtime = self.display_time(
-                        self.settings[server.id]["PAYDAY_TIME"] - seconds)
+                    dtime = self.display_time(math.ceil(remaining))
                     await self.bot.say(
                         "{} Too soon. For your next payday you have to"
                         " wait {}.".format(author.mention, dtime))
-            else:
-                self.payday_register[server.id][id] = int(time.perf_counter())
-                self.bank.deposit_credits(author, self.settings[
-                    server.id]["PAYDAY_CREDITS"])
-                await self.bot.say(
-                    "{} Here, take some credits. Enjoy! (+{} credits!)".format(
-                        author.mention,
-                        str(self.settings[server.id]["PAYDAY_CREDITS"])))
         else:
             await self.bot.say("{} You need an account to receive credits."
                                " Type `{}bank register` to open one.".format(
@@ -225,20 +586,22 @@ class Bank:
         server = ctx.message.server
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_server_accounts(server),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if
-                       a.member]  # exclude users who left
-        if len(bank_sorted) < top:
-            top = len(bank_sorted)
-        topten = bank_sorted[:top]
+        topten = []
+        for balance, user_id in self.balance_index.iter_server(server.id):
+            member = server.get_member(user_id)
+            if member is None:  # exclude users who left
+                continue
+            topten.append((member, balance))
+            if len(topten) == top:
+                break
+        top = len(topten)
         highscore = ""
         place = 1
-        for acc in topten:
+        for member, balance in topten:
             highscore += str(place).ljust(len(str(top)) + 1)
-            highscore += (str(acc.member.display_name) + " ").ljust(
-                23 - len(str(acc.balance)))
-            highscore += str(acc.balance) + "\n"
+            highscore += (str(member.display_name) + " ").ljust(
+                23 - len(str(balance)))
+            highscore += str(balance) + "\n"
             place += 1
         if highscore != "":
             for page in pagify(highscore, shorten_by=12):
@@ -252,24 +615,24 @@ class Bank:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-                             key=lambda x: x.balance, reverse=True)
-        bank_sorted = [a for a in bank_sorted if
-                       a.member]  # exclude users who left
-        unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
-                unique_accounts.append(acc)
-        if len(unique_accounts) < top:
-            top = len(unique_accounts)
-        topten = unique_accounts[:top]
+        servers = {server.id: server for server in self.bot.servers}
+        top_users = self.balance_index.top_global(
+            list(servers), top,  # exclude users who left
+            keep=lambda server_id, user_id: servers[server_id].get_member(
+                user_id) is not None)
+        unique_accounts = [
+            self.vault.get_account(servers[server_id].get_member(user_id),
+                                   self.account_name)
+            for balance, server_id, user_id in top_users]
+        top = len(unique_accounts)
         highscore = ""
         place = 1
-        for acc in topten:
+        for acc in unique_accounts:
+            balance = acc.storage["balance"]
             highscore += str(place).ljust(len(str(top)) + 1)
             highscore += ("{} |{}| ".format(acc.member, acc.server)
-                          ).ljust(23 - len(str(acc.balance)))
-            highscore += str(acc.balance) + "\n"
+                          ).ljust(23 - len(str(balance)))
+            highscore += str(balance) + "\n"
             place += 1
         if highscore != "":
             for page in pagify(highscore, shorten_by=12):
@@ -277,11 +640,85 @@ class Bank:
         else:
             await self.bot.say("There are no accounts in the bank.")
 
-    def already_in_list(self, accounts, user):
-        for acc in accounts:
-            if user.id == acc.id:
-                return True
-        return False
+    @leaderboard.command(name="rank", pass_context=True, no_pm=True)
+    async def _rank_leaderboard(self, ctx, user: discord.Member = None):
+        """Shows a user's place on the server leaderboard
+        Defaults to yours."""
+        if not user:
+            user = ctx.message.author
+        server = ctx.message.server
+        # same places as the server leaderboard, which skips departed users
+        rank, count = self.balance_index.rank_among(
+            server.id, user.id, [member.id for member in server.members])
+        if rank is None:
+            await self.bot.say("That user has no bank account.")
+        else:
+            await self.bot.say("{} is ranked #{} of {} with {} credits."
+                               "".format(user.name, rank, count,
+                                         self._get_balance(user)))
+
+    @staticmethod
+    def display_time(seconds, granularity=2):
+        intervals = (  # Source: http://stackoverflow.com/a/24542445
+            ('weeks', 604800),  # 60 * 60 * 24 * 7
+            ('days', 86400),  # 60 * 60 * 24
+            ('hours', 3600),  # 60 * 60
+            ('minutes', 60),
+            ('seconds', 1),
+        )
+        result = []
+        for name, count in intervals:
+            value = seconds // count
+            if value:
+                seconds -= value * count
+                if value == 1:
+                    name = name.rstrip('s')
+                result.append("{} {}".format(value, name))
+        return ', '.join(result[:granularity])
+
+    def _record_payday(self, server, credits):
+        days = self.payday_totals[server.id]
+        days[datetime.utcnow().strftime("%Y-%m-%d")] += credits
+        while len(days) > 30:
+            del days[min(days)]
+
+    @commands.command(pass_context=True, no_pm=True)
+    async def economystats(self, ctx):
+        """Shows money supply, median balance, inequality and payday
+        inflation for this server"""
+        server = ctx.message.server
+        if self.balance_columns is None:
+            await self.bot.say("Economy statistics require numpy, install it "
+                               "with: pip3 install numpy")
+            return
+        balances = self.balance_columns.values(server.id)
+        count = len(balances)
+        if count == 0:
+            await self.bot.say("There are no accounts in the bank.")
+            return
+        ordered = numpy.sort(balances).astype(numpy.float64)
+        supply = ordered.sum()
+        gini = 0.0
+        if supply > 0:
+            ranks = numpy.arange(1, count + 1)
+            gini = (2.0 * numpy.dot(ranks, ordered) / (count * supply) -
+                    (count + 1.0) / count)
+        paydays = self.payday_totals[server.id]
+        today = paydays.get(datetime.utcnow().strftime("%Y-%m-%d"), 0)
+        daily = sum(paydays.values()) / len(paydays) if paydays else 0
+        msg = ("Accounts:              {}\n"
+               "Money supply:          {}\n"
+               "Mean balance:          {:.2f}\n"
+               "Median balance:        {:.2f}\n"
+               "Richest account:       {}\n"
+               "Gini coefficient:      {:.3f}\n"
+               "Payday credits today:  {} ({:.2%} of supply)\n"
+               "Payday credits / day:  {:.0f} over the last {} days"
+               "".format(count, int(supply), supply / count,
+                         numpy.median(ordered), int(ordered[-1]), gini,
+                         today, today / supply if supply else 0, daily,
+                         len(paydays)))
+        await self.bot.say(box(msg))
 
     @commands.command()
     async def payouts(self):
@@ -294,19 +731,19 @@ class Bank:
         author = ctx.message.author
         server = author.server
         settings = self.settings[server.id]
-        valid_bid = settings["SLOT_MIN"] <= bid and bid <= settings["SLOT_MAX"]
-        slot_time = settings["SLOT_TIME"]
-        last_slot = self.slot_register.get(author.id)
-        now = datetime.utcnow()
+        valid_bid = settings.SLOT_MIN <= bid and bid <= settings.SLOT_MAX
+        slot_time = settings.SLOT_TIME
         try:
-            if last_slot:
-                if (now - last_slot).seconds < slot_time:
-                    raise OnCooldown()
+            if self.cooldowns.remaining(("slot", author.id)):
+                raise OnCooldown()
             if not valid_bid:
                 raise InvalidBid()
-            if not self.bank.can_spend(author, bid):
-                raise InsufficientBalance
-            await self.slot_machine(author, bid)
+            async with self._account_lock(author):
+                if not self._can_spend(author, bid):
+                    raise InsufficientBalance
+                if self.cooldowns.try_start(("slot", author.id), slot_time):
+                    raise OnCooldown()
+                await self.slot_machine(author, bid)
         except NoAccount:
             await self.bot.say("{} You need an account to use the slot "
                                "machine. Type `{}bank register` to open one."
@@ -319,55 +756,24 @@ class Bank:
                                "seconds between each pull".format(slot_time))
         except InvalidBid:
             await self.bot.say("Bid must be between {} and {}."
-                               "".format(settings["SLOT_MIN"],
-                                         settings["SLOT_MAX"]))
+                               "".format(settings.SLOT_MIN,
+                                         settings.SLOT_MAX))
 
     async def slot_machine(self, author, bid):
-        default_reel = deque(SMReel)
-        reels = []
-        self.slot_register[author.id] = datetime.utcnow()
-        for i in range(3):
-            default_reel.rotate(random.randint(-999, 999))  # weeeeee
-            new_reel = deque(default_reel, maxlen=3)  # we need only 3 symbols
-            reels.append(new_reel)  # for each reel
-        rows = ((reels[0][0], reels[1][0], reels[2][0]),
-                (reels[0][1], reels[1][1], reels[2][1]),
-                (reels[0][2], reels[1][2], reels[2][2]))
-
-        slot = "~~\n~~"  # Mobile friendly
-        for i, row in enumerate(rows):  # Let's build the slot to show
-            sign = "  "
-            if i == 1:
-                sign = ">"
-            slot += "{}{} {} {}\n".format(sign, *[c.value for c in row])
-
-        payout = PAYOUTS.get(rows[1])
-        if not payout:
-            # Checks for two-consecutive-symbols special rewards
-            payout = PAYOUTS.get((rows[1][0], rows[1][1]),
-                                 PAYOUTS.get((rows[1][1], rows[1][2]))
-                                 )
-        if not payout:
-            # Still nothing. Let's check for 3 generic same symbols
-            # or 2 consecutive symbols
-            has_three = rows[1][0] == rows[1][1] == rows[1][2]
-            has_two = (rows[1][0] == rows[1][1]) or (rows[1][1] == rows[1][2])
-            if has_three:
-                payout = PAYOUTS["3 symbols"]
-            elif has_two:
-                payout = PAYOUTS["2 symbols"]
-
+        pull = random.randrange(len(SLOT_PAYOUTS))
+        slot = SLOT_TEXTS[pull]
+        payout = PAYOUTS.get(SLOT_PAYOUTS[pull])
         if payout:
-            then = self.bank.get_balance(author)
+            then = self._get_balance(author)
             pay = payout["payout"](bid)
             now = then - bid + pay
-            self.bank.set_credits(author, now)
+            self._set_credits(author, now)
             await self.bot.say("{}\n{} {}\n\nYour bid: {}\n{} → {}!"
                                "".format(slot, author.mention,
                                          payout["phrase"], bid, then, now))
         else:
-            then = self.bank.get_balance(author)
-            self.bank.withdraw_credits(author, bid)
+            then = self._get_balance(author)
+            self._withdraw_credits(author, bid)
             now = then - bid
             await self.bot.say("{}\n{} Nothing!\nYour bid: {}\n{} → {}!"
                                "".format(slot, author.mention, bid, then, now))
@@ -390,43 +796,38 @@ class Bank:
     async def slotmin(self, ctx, bid: int):
         """Minimum slot machine bid"""
         server = ctx.message.server
-        self.settings[server.id]["SLOT_MIN"] = bid
+        self.settings.set(server.id, "SLOT_MIN", bid)
         await self.bot.say("Minimum bid is now {} credits.".format(bid))
-        dataIO.save_json(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slotmax(self, ctx, bid: int):
         """Maximum slot machine bid"""
         server = ctx.message.server
-        self.settings[server.id]["SLOT_MAX"] = bid
+        self.settings.set(server.id, "SLOT_MAX", bid)
         await self.bot.say("Maximum bid is now {} credits.".format(bid))
-        dataIO.save_json(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def slottime(self, ctx, seconds: int):
         """Seconds between each slots use"""
         server = ctx.message.server
-        self.settings[server.id]["SLOT_TIME"] = seconds
+        self.settings.set(server.id, "SLOT_TIME", seconds)
         await self.bot.say("Cooldown is now {} seconds.".format(seconds))
-        dataIO.save_json(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaytime(self, ctx, seconds: int):
         """Seconds between each payday"""
         server = ctx.message.server
-        self.settings[server.id]["PAYDAY_TIME"] = seconds
+        self.settings.set(server.id, "PAYDAY_TIME", seconds)
         await self.bot.say("Value modified. At least {} seconds must pass "
                            "between each payday.".format(seconds))
-        dataIO.save_json(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def paydaycredits(self, ctx, credits: int):
         """Credits earned each payday"""
         server = ctx.message.server
-        self.settings[server.id]["PAYDAY_CREDITS"] = credits
+        self.settings.set(server.id, "PAYDAY_CREDITS", credits)
         await self.bot.say("Every payday will now give {} credits."
                            "".format(credits))
-        dataIO.save_json(self.file_path, self.settings)
 
     @economyset.command(pass_context=True)
     async def registercredits(self, ctx, credits: int):
@@ -434,10 +835,34 @@ class Bank:
         server = ctx.message.server
         if credits < 0:
             credits = 0
-        self.settings[server.id]["REGISTER_CREDITS"] = credits
+        self.settings.set(server.id, "REGISTER_CREDITS", credits)
         await self.bot.say("Registering an account will now give {} credits."
                            "".format(credits))
-        dataIO.save_json(self.file_path, self.settings)
+
+    @economyset.command(pass_context=True)
+    async def slotsim(self, ctx, pulls: int = 1000000):
+        """Simulates slot pulls and shows the expected return per bid
+
+        Reports the minimum and maximum bid and a few bids in between, with
+        the exact return computed from every possible pull for comparison"""
+        server = ctx.message.server
+        settings = self.settings[server.id]
+        if numpy is None:
+            await self.bot.say("The slot simulator requires numpy, install it "
+                               "with: pip3 install numpy")
+            return
+        pulls = max(1, min(pulls, 10000000))
+        low, high = settings.SLOT_MIN, settings.SLOT_MAX
+        bids = sorted(set(int(bid) for bid in
+                          numpy.geomspace(max(low, 1), max(high, 1), 5)))
+        results = await self.bot.loop.run_in_executor(
+            None, simulate_slots, pulls, bids)
+        msg = "{} pulls\n\n{:>8} {:>10} {:>10} {:>10}\n".format(
+            pulls, "Bid", "Simulated", "Exact", "House edge")
+        for bid, simulated, exact in results:
+            msg += "{:>8} {:>10.2%} {:>10.2%} {:>10.2%}\n".format(
+                bid, simulated, exact, 1 - exact)
+        await self.bot.say(box(msg))
 
 
 
@@ -491,4 +916,4 @@ def setup(bot):
     check_folders()
     check_files()
     create_logging("red.bank", "data/bank", "bank.log")
-    bot.add_cog(Economy(bot))
+    bot.add_cog(Bank(bot))
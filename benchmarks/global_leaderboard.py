@@ -0,0 +1,100 @@
+"""
+Times Bank's global leaderboard path (AccountIndex.top_global over a json 
+vault) for growing numbers of accounts. Run it from the Red bot's directory
+so the cogs package can be imported:
+    python /path/to/benchmarks/global_leaderboard.py [accounts ...]
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.getcwd())
+
+
+async def send_cmd_help(ctx):
+    # cogs import this from Red's __main__, which this script replaces
+    pass
+
+
+from cogs.vault import JsonVaultBackend, VaultClass
+
+ACCOUNTS_PER_SERVER = 1000
+MAX_LOADED_SHARDS = 256
+
+
+class FakeBot:
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+
+
+def write_vault(directory, accounts):
+    """
+    writes accounts spread over shards of ACCOUNTS_PER_SERVER, users are 
+    drawn from half as many ids so most of them hold several accounts
+    :param directory: folder to write the vault in
+    :param accounts: number of accounts
+    :return: (vault path, {server id: set of user ids})
+    """
+    vault_path = os.path.join(directory, "bank.json")
+    shard_directory = os.path.join(directory, "bank")
+    os.makedirs(shard_directory)
+    members = {}
+    user_ids = max(1, accounts // 2)
+    for server in range(max(1, accounts // ACCOUNTS_PER_SERVER)):
+        server_id = str(server)
+        users = set(str(random.randrange(user_ids))
+                    for _ in range(ACCOUNTS_PER_SERVER))
+        shard = {user_id: {"bank": {"metadata": {}, "storage": {
+            "balance": random.randrange(10 ** 6)}}} for user_id in users}
+        with open(os.path.join(shard_directory, server_id + ".json"),
+                  "w") as shard_file:
+            json.dump(shard, shard_file)
+        members[server_id] = users
+    return vault_path, members
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run(accounts):
+    directory = tempfile.mkdtemp()
+    try:
+        vault_path, members = write_vault(directory, accounts)
+        backend = JsonVaultBackend(vault_path,
+                                   max_loaded_shards=MAX_LOADED_SHARDS)
+        vault = VaultClass(FakeBot(), backend, flush_interval=0)
+        index = vault.add_index(
+            "balance", "bank", lambda account: account["storage"]["balance"])
+        server_ids = list(members)
+        total = sum(len(users) for users in members.values())
+
+        def keep(server_id, user_id):
+            return user_id in members[server_id]
+
+        cold, _ = timed(index.top_global, server_ids, 10, keep)
+        warm, _ = timed(index.top_global, server_ids, 10, keep)
+        full, _ = timed(index.top_global, server_ids, None, keep)
+        print("{:>9} accounts {:>5} servers | first {:7.3f}s | top 10 "
+              "{:7.4f}s | all users {:7.3f}s ({:.2f}us per account)".format(
+                  total, len(server_ids), cold, warm, full,
+                  full / total * 10 ** 6))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000]
+    for accounts in sizes:
+        run(accounts)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,387 @@
 import discord
 from discord.ext import commands
-from gtts import gTTS
+from cogs.utils.dataIO import dataIO
+from collections import Counter, OrderedDict, deque
+from copy import deepcopy
 import os
+import shutil
+import hashlib
+import time
+import subprocess
 import asyncio
 from .utils import checks
+from __main__ import send_cmd_help
+
+try:
+    from gtts import gTTS
+except ImportError:
+    gTTS = None
+
+GTTS_MISSING = ("The gtts engine requires gTTS, install it with: "
+                "pip3 install gTTS")
+ESPEAK_MISSING = ("The espeak engine requires espeak or espeak-ng to be "
+                  "installed and on the PATH")
+VOICE_MISSING = ("Announcements are played through snakecogutils, load it "
+                 "with: [p]load snakecogutils")
+
+default_settings = {"TTS_ENGINE": "gtts", "TTS_LANG": "en", "CACHE_MB": 50,
+                    "PREWARM_MEMBERS": 20, "QUEUE_DEPTH": 10,
+                    "DEBOUNCE_SECONDS": 1.5, "RATE_PER_MINUTE": 6,
+                    "RATE_BURST": 3, "RATE_POLICY": "merge",
+                    "IDLE_SECONDS": 60, "SERVERS": {}}
+RATE_POLICIES = ("drop", "merge")
+
+
+class GTTSEngine:
+    """Google Translate text to speech, needs network access"""
+    name = "gtts"
+    extension = ".mp3"
+
+    def synthesize(self, text, lang, path):
+        if gTTS is None:
+            raise RuntimeError(GTTS_MISSING)
+        gTTS(text=text, lang=lang).save(path)
+
+
+class EspeakEngine:
+    """Local espeak synthesis, works offline (ie for testing)"""
+    name = "espeak"
+    extension = ".wav"
+
+    def __init__(self):
+        self.command = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def synthesize(self, text, lang, path):
+        if self.command is None:
+            raise RuntimeError(ESPEAK_MISSING)
+        subprocess.run([self.command, "-v", lang, "-w", path, text],
+                       check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+
+TTS_ENGINES = {"gtts": GTTSEngine,
+               "espeak": EspeakEngine}
+
+
+class TTSCache:
+    def __init__(self, loop, directory, engine, max_bytes):
+        """
+        Synthesized speech stored on disk under a hash of (engine, lang, 
+        text), so a phrase is only synthesized once. Files are evicted least
+        recently used first once they take more than max_bytes, use is 
+        recorded in the file mtime so the order survives restarts
+        :param loop: event loop, synthesis runs in its default executor
+        :param directory: folder holding only cached audio
+        :param engine: one of TTS_ENGINES
+        :param max_bytes: most bytes of audio kept
+        """
+        self.loop = loop
+        self.directory = directory
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+
+    def key(self, text, lang):
+        digest = hashlib.sha1("{}\0{}\0{}".format(
+            self.engine.name, lang, text).encode("utf-8")).hexdigest()
+        return digest + self.engine.extension
+
+    async def get(self, text, lang):
+        """
+        :param text: phrase to speak
+        :param lang: language code
+        :return: path to the audio file, synthesizing it on a miss
+        """
+        name = self.key(text, lang)
+        path = os.path.join(self.directory, name)
+        if name in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(name)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        task = self.pending.get(name)
+        if task is None:
+            self.misses += 1
+            task = self.pending[name] = self.loop.create_task(
+                self._create(name, text, lang, path))
+        # a cancelled caller mustn't cancel synthesis others wait on
+        await asyncio.shield(task)
+        return path
+
+    async def _create(self, name, text, lang, path):
+        try:
+            size = await self.loop.run_in_executor(
+                None, self._synthesize, text, lang, path)
+        finally:
+            del self.pending[name]
+        self.entries[name] = size
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            old_name, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+
+    def _synthesize(self, text, lang, path):
+        temp_path = path + ".tmp"
+        self.engine.synthesize(text, lang, temp_path)
+        os.replace(temp_path, path)
+        return os.path.getsize(path)
+
+    async def prewarm(self, phrases, lang):
+        """
+        synthesizes phrases one at a time ahead of their first use
+        :param phrases: texts to cache
+        :param lang: language code
+        :return: 
+        """
+        for text in phrases:
+            try:
+                await self.get(text, lang)
+            except Exception as exception:
+                print("Could not prewarm \"{}\": {}".format(text, exception))
+                return
+
+
+def announcement(names, joined, most_names=5):
+    """
+    :param names: member names, ie ["A", "B", "C"]
+    :param joined: True for joins, False for leaves
+    :param most_names: names spoken before the rest are counted instead
+    :return: ie "A, B and C have joined the channel"
+    """
+    if len(names) > most_names:
+        others = len(names) - most_names + 1
+        names = names[:most_names - 1] + ["{} others".format(others)]
+    if len(names) == 1:
+        who = names[0]
+    else:
+        who = "{} and {}".format(", ".join(names[:-1]), names[-1])
+    if joined:
+        verb = "has joined" if len(names) == 1 else "have joined"
+    else:
+        verb = "has left" if len(names) == 1 else "have left"
+    return "{} {} the channel".format(who, verb)
+
+
+class Announcement:
+    """A pending announcement, either speech for members or a sound file"""
+    __slots__ = ("channel", "joined", "names", "path")
+
+    def __init__(self, channel, joined=None, names=None, path=None):
+        self.channel = channel
+        self.joined = joined
+        self.names = names
+        self.path = path
+
+    def merges_with(self, other):
+        return (self.path is None and other.path is None and
+                self.channel == other.channel and self.joined == other.joined)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        self._refill()
+        if self.rate <= 0:
+            return 60.0
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class ServerAnnouncer:
+    def __init__(self, cog, server, max_depth):
+        """
+        The one playback worker of a server. Joins and leaves are gathered
+        per channel for DEBOUNCE_SECONDS (a member leaving and rejoining 
+        within the window cancels out), then rate limited per server, over 
+        the limit they are dropped or held and merged until allowed 
+        depending on RATE_POLICY. Announcements wait in a bounded queue (the
+        oldest is dropped when full) and are played one after the other, 
+        joins or leaves queued for the same channel while something plays 
+        are merged into a single phrase
+        :param cog: OnJoin cog doing the synthesis and playback
+        :param server: discord server
+        :param max_depth: most announcements waiting
+        """
+        self.cog = cog
+        self.server = server
+        self.loop = cog.bot.loop
+        self.pending = deque(maxlen=max_depth)
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        # channel id -> (channel, {member name: joined})
+        self.batches = {}
+        self.flushes = {}
+        self.held = []
+        self.retry = None
+        self.bucket = None
+        self.stats = Counter()
+        self.task = self.loop.create_task(self._run())
+
+    def event(self, channel, name, joined):
+        """
+        records a member joining or leaving channel
+        :param channel: voice channel
+        :param name: member name
+        :param joined: True for a join, False for a leave
+        :return: 
+        """
+        self.stats["events"] += 1
+        batch = self.batches.get(channel.id)
+        if batch is None:
+            batch = self.batches[channel.id] = (channel, OrderedDict())
+            self.flushes[channel.id] = self.loop.call_later(
+                self.cog.server_settings(self.server)["DEBOUNCE_SECONDS"],
+                self._flush, channel.id)
+        changes = batch[1]
+        if changes.get(name, joined) != joined:
+            del changes[name]
+            self.stats["cancelled"] += 2
+        else:
+            changes[name] = joined
+
+    def _flush(self, channel_id):
+        del self.flushes[channel_id]
+        channel, changes = self.batches.pop(channel_id)
+        for joined in (True, False):
+            names = [name for name, change in changes.items()
+                     if change == joined]
+            if names:
+                self._release(Announcement(channel, joined, names))
+
+    def _take(self):
+        settings = self.cog.server_settings(self.server)
+        rate, burst = settings["RATE_PER_MINUTE"], settings["RATE_BURST"]
+        if (self.bucket is None or self.bucket.rate != rate / 60.0 or
+                self.bucket.burst != burst):
+            self.bucket = TokenBucket(rate, burst)
+        return self.bucket.take()
+
+    def _release(self, item):
+        if self._take():
+            self.stats["announced"] += len(item.names)
+            self.put(item)
+        elif self.cog.server_settings(self.server)["RATE_POLICY"] == "drop":
+            self.stats["rate_dropped"] += len(item.names)
+        else:
+            self.stats["rate_merged"] += len(item.names)
+            self._hold(item)
+
+    def _hold(self, item):
+        for held in self.held:
+            if held.merges_with(item):
+                held.names.extend(name for name in item.names
+                                  if name not in held.names)
+                break
+        else:
+            self.held.append(item)
+        if self.retry is None:
+            self.retry = self.loop.call_later(self.bucket.wait_time(),
+                                              self._release_held)
+
+    def _release_held(self):
+        self.retry = None
+        held, self.held = self.held, []
+        for item in held:
+            if self._take():
+                self.stats["announced"] += len(item.names)
+                self.put(item)
+            else:
+                self._hold(item)
+
+    def put(self, item):
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(item)
+        self.wakeup.set()
+
+    def _next(self):
+        item = self.pending.popleft()
+        if item.path is not None:
+            return item
+        names = list(item.names)
+        remaining = deque(maxlen=self.pending.maxlen)
+        for other in self.pending:
+            if item.merges_with(other):
+                names.extend(name for name in other.names
+                             if name not in names)
+            else:
+                remaining.append(other)
+        self.pending = remaining
+        return Announcement(item.channel, item.joined, names)
+
+    async def _run(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.pending:
+                    try:
+                        await self._play(self._next())
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as exception:
+                        print("Announcement on {} failed: {}".format(
+                            self.server.id, exception))
+        except asyncio.CancelledError:
+            pass
+
+    async def _play(self, item):
+        path = item.path
+        if path is None:
+            path = await self.cog.tts.get(
+                announcement(item.names, item.joined),
+                self.cog.settings["TTS_LANG"])
+        await self.cog.sound_play(self.server, item.channel, path)
+
+    def stop(self):
+        self.task.cancel()
+        for handle in self.flushes.values():
+            handle.cancel()
+        if self.retry is not None:
+            self.retry.cancel()
 
 
 class OnJoin:
@@ -11,73 +389,88 @@ class OnJoin:
 
     def __init__(self, bot):
         self.bot = bot
-        self.audio_players = {}
+        self.dependencies = ["snakecogutils"]
+        self._load_dependencies()
 
-        # generate save_path
-        par_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
-        self.save_path = par_dir + '\\Red-DiscordBot\\data\\on_join'
+        self.save_path = os.path.join("data", "on_join")
         if not os.path.exists(self.save_path):
             os.makedirs(self.save_path)
+        self.settings_path = os.path.join(self.save_path, "settings.json")
+        # SERVERS is filled in per server, never share the module's dict
+        self.settings = deepcopy(default_settings)
+        if dataIO.is_valid_json(self.settings_path):
+            self.settings.update(dataIO.load_json(self.settings_path))
+        self.tts = TTSCache(bot.loop,
+                            os.path.join(self.save_path, "tts_cache"),
+                            TTS_ENGINES[self.settings["TTS_ENGINE"]](),
+                            self.settings["CACHE_MB"] * 1024 * 1024)
+        # member name -> announcements, to prewarm the most frequent ones
+        self.frequent_path = os.path.join(self.save_path, "frequent.json")
+        self.announced = Counter()
+        if dataIO.is_valid_json(self.frequent_path):
+            self.announced.update(dataIO.load_json(self.frequent_path))
+        self._prewarm_task = bot.loop.create_task(self._prewarm())
+        self.announcers = {}
 
-    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
-        return (voice_channel.user_limit != 0 and
-                len(voice_channel.voice_members) >= voice_channel.user_limit)
+    def __unload(self):
+        self._prewarm_task.cancel()
+        for announcer in self.announcers.values():
+            announcer.stop()
+        dataIO.save_json(self.frequent_path,
+                         dict(self.announced.most_common(1000)))
 
-    def voice_connected(self, server: discord.Server) -> bool:
-        return self.bot.is_voice_connected(server)
+    async def _prewarm(self):
+        names = [name for name, count in self.announced.most_common(
+            self.settings["PREWARM_MEMBERS"])]
+        phrases = [announcement([name], joined) for name in names
+                   for joined in (True, False)]
+        await self.tts.prewarm(phrases, self.settings["TTS_LANG"])
 
-    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
-        return self.bot.voice_client_in(server)
+    def server_settings(self, server: discord.Server) -> dict:
+        settings = dict(self.settings)
+        settings.update(self.settings["SERVERS"].get(server.id, {}))
+        return settings
 
-    async def _leave_voice_channel(self, server: discord.Server):
-        if not self.voice_connected(server):
-            return
-        voice_client = self.voice_client(server)
+    def _set_server_setting(self, server: discord.Server, key, value):
+        self.settings["SERVERS"].setdefault(server.id, {})[key] = value
+        dataIO.save_json(self.settings_path, self.settings)
 
-        if server.id in self.audio_players:
-            self.audio_players[server.id].stop()
-        await voice_client.disconnect()
+    def announcer(self, server: discord.Server) -> ServerAnnouncer:
+        announcer = self.announcers.get(server.id)
+        if announcer is None:
+            announcer = self.announcers[server.id] = ServerAnnouncer(
+                self, server, self.settings["QUEUE_DEPTH"])
+        return announcer
 
-    async def wait_for_disconnect(self, server: discord.Server):
-        while not self.audio_players[server.id].is_done():
-            await asyncio.sleep(0.01)
-        await self._leave_voice_channel(server)
+    @property
+    def voice(self):
+        """
+        :return: the VoiceManager shared by the cogs, None if snakecogutils 
+        isn't loaded
+        """
+        utils = self.bot.get_cog("TestBot")
+        return utils.voice if utils is not None else None
 
-    async def sound_init(self, server: discord.Server, path: str):
-        options = "-filter \"volume=volume=1.00\""
-        voice_client = self.voice_client(server)
-        self.audio_players[server.id] = voice_client.create_ffmpeg_player(
-            path, options=options)
+    def _load_dependencies(self):
+        owner = self.bot.get_cog("Owner")
+        for cogname in self.dependencies:
+            if owner is None or "cogs." + cogname in self.bot.extensions:
+                continue
+            try:
+                owner._load_cog("cogs." + cogname)
+            except Exception as exception:
+                print("Could not load {} for on_join: {}".format(cogname,
+                                                                exception))
 
     async def sound_play(self, server: discord.Server,
-                         channel: discord.Channel, p: str):
-        if self.voice_channel_full(channel):
+                         channel: discord.Channel, path: str):
+        voice = self.voice
+        if voice is None:
+            print(VOICE_MISSING)
             return
-
-        if not channel.is_private:
-            if self.voice_connected(server):
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-            else:
-                await self.bot.join_voice_channel(channel)
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
+        await voice.play(server, channel, path,
+                         idle_seconds=self.server_settings(server)[
+                             "IDLE_SECONDS"])
 
     async def voice_state_update(self, before: discord.Member, after: discord.Member):
         bserver = before.server
@@ -93,27 +486,110 @@ class OnJoin:
             # went from no channel to a channel
             if (bvchan is None and avchan is not None):
                 # came online
-                text = "{} has joined the channel".format(after.name)
-                channel = avchan
-                server = aserver
+                self.announcer(aserver).event(avchan, after.name, True)
             elif (bvchan is not None and avchan is None):
                 # went offline
-                text = "{} has left the channel".format(before.name)
-                channel = bvchan
-                server = bserver
+                self.announcer(bserver).event(bvchan, before.name, False)
             else:
                 return
-            tts = gTTS(text=text, lang='en')
-            tts.save(self.save_path + "\\temp_message.mp3")
-            await self.sound_play(server, channel, self.save_path + "\\temp_message.mp3")
+            self.announced[after.name] += 1
 
     @checks.admin_or_permissions(manage_server=True)
     @commands.command(pass_context=True, no_pm=True, name='seals')
     async def seals(self, ctx: commands.Context):
         server = ctx.message.author.server
         channel = ctx.message.author.voice_channel
-        await self.sound_play(server, channel,
-                              self.save_path + "\\seals.mp3")
+        self.announcer(server).put(Announcement(
+            channel, path=os.path.join(self.save_path, "seals.mp3")))
+
+    @commands.group(pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def onjoinset(self, ctx):
+        """Changes join announcement settings for this server"""
+        if ctx.invoked_subcommand is None:
+            settings = self.server_settings(ctx.message.server)
+            msg = "```"
+            for k in ("DEBOUNCE_SECONDS", "RATE_PER_MINUTE", "RATE_BURST",
+                      "RATE_POLICY", "IDLE_SECONDS"):
+                msg += "{}: {}\n".format(k, settings[k])
+            msg += "```"
+            await send_cmd_help(ctx)
+            await self.bot.say(msg)
+
+    @onjoinset.command(pass_context=True)
+    async def debounce(self, ctx, seconds: float):
+        """Seconds joins and leaves are gathered into one announcement"""
+        seconds = max(0.0, seconds)
+        self._set_server_setting(ctx.message.server, "DEBOUNCE_SECONDS",
+                                 seconds)
+        await self.bot.say("Joins and leaves are now gathered for {} "
+                           "seconds.".format(seconds))
+
+    @onjoinset.command(pass_context=True)
+    async def ratelimit(self, ctx, per_minute: int, burst: int = 3):
+        """Announcements allowed per minute, and in a burst"""
+        per_minute = max(0, per_minute)
+        burst = max(1, burst)
+        self._set_server_setting(ctx.message.server, "RATE_PER_MINUTE",
+                                 per_minute)
+        self._set_server_setting(ctx.message.server, "RATE_BURST", burst)
+        await self.bot.say("At most {} announcements a minute, {} at once."
+                           "".format(per_minute, burst))
+
+    @onjoinset.command(pass_context=True)
+    async def idle(self, ctx, seconds: int):
+        """Seconds of silence before leaving voice, 0 to stay connected"""
+        seconds = max(0, seconds)
+        self._set_server_setting(ctx.message.server, "IDLE_SECONDS", seconds)
+        if seconds:
+            await self.bot.say("Voice is now left after {} idle seconds."
+                               "".format(seconds))
+        else:
+            await self.bot.say("Voice is now never left when idle.")
+
+    @onjoinset.command(pass_context=True)
+    async def policy(self, ctx, policy: str):
+        """What happens over the rate limit: drop or merge
+
+        drop discards the announcement, merge holds it and combines it with
+        later ones until the rate limit allows playing it"""
+        policy = policy.lower()
+        if policy not in RATE_POLICIES:
+            await self.bot.say("Policy must be one of: {}".format(
+                ", ".join(RATE_POLICIES)))
+            return
+        self._set_server_setting(ctx.message.server, "RATE_POLICY", policy)
+        if policy == "drop":
+            await self.bot.say("Announcements over the rate limit are now "
+                               "dropped.")
+        else:
+            await self.bot.say("Announcements over the rate limit are now "
+                               "held and merged.")
+
+    @commands.command(pass_context=True, no_pm=True, name='onjoinstats')
+    async def onjoinstats(self, ctx: commands.Context):
+        """Shows how many join and leave events were announced or
+        suppressed on this server"""
+        announcer = self.announcers.get(ctx.message.server.id)
+        stats = announcer.stats if announcer is not None else Counter()
+        dropped = announcer.dropped if announcer is not None else 0
+        await self.bot.say("{} events: {} announced, {} cancelled out, "
+                           "{} dropped and {} held by the rate limit, {} "
+                           "dropped from a full queue".format(
+                               stats["events"], stats["announced"],
+                               stats["cancelled"], stats["rate_dropped"],
+                               stats["rate_merged"], dropped))
+
+    @checks.admin_or_permissions(manage_server=True)
+    @commands.command(pass_context=True, name='ttsstats')
+    async def ttsstats(self, ctx: commands.Context):
+        """Shows text to speech cache usage"""
+        await self.bot.say("TTS cache ({}): {} phrases, {:.1f} of {} MB, "
+                           "{} hits, {} misses".format(
+                               self.tts.engine.name, len(self.tts.entries),
+                               self.tts.size / 1024 / 1024,
+                               self.settings["CACHE_MB"], self.tts.hits,
+                               self.tts.misses))
 
 
 def setup(bot):
@@ -3,7 +3,7 @@ from datetime import datetime
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
 from random import choice
-from collections import namedtuple, OrderedDict
+from collections import namedtuple, OrderedDict, defaultdict
 from copy import deepcopy
 from __main__ import send_cmd_help
 from .utils import checks
@@ -13,11 +13,158 @@ import asyncio
 
 description = "What're ya buyin', PEN ISLAND traveler?"
 
+DEFAULT_OPTIONS = "-filter \"volume=volume=1.00\""
+
+
+class VoiceManager:
+    def __init__(self, bot, idle_seconds=60):
+        """
+        Owns the voice connection and the ffmpeg player of every server for
+        all cogs, reach it through bot.get_cog("TestBot").voice. Sounds of a
+        server are played one at a time in the order they were asked for, 
+        and the bot leaves voice after idle_seconds without anything to play
+        :param bot: discord bot object
+        :param idle_seconds: default silence before leaving voice, 0 to stay
+        """
+        self.bot = bot
+        self.loop = bot.loop
+        self.idle_seconds = idle_seconds
+        self.players = {}
+        self.players_done = {}
+        self.idle_timers = {}
+        # waiting on a server's lock is its playback queue
+        self.locks = defaultdict(asyncio.Lock)
+
+    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
+        return (voice_channel.user_limit != 0 and
+                len(voice_channel.voice_members) >= voice_channel.user_limit)
+
+    def voice_connected(self, server: discord.Server) -> bool:
+        return self.bot.is_voice_connected(server)
+
+    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
+        return self.bot.voice_client_in(server)
+
+    def is_playing(self, server: discord.Server) -> bool:
+        player = self.players.get(server.id)
+        return player is not None and player.is_playing()
+
+    async def connect(self, server: discord.Server,
+                      channel: discord.Channel) -> discord.VoiceClient:
+        """
+        joins channel, or moves there once the sound playing is over
+        """
+        async with self.locks[server.id]:
+            return await self._connect(server, channel)
+
+    async def _connect(self, server: discord.Server,
+                       channel: discord.Channel) -> discord.VoiceClient:
+        self._cancel_idle(server)
+        if not self.voice_connected(server):
+            return await self.bot.join_voice_channel(channel)
+        voice_client = self.voice_client(server)
+        if voice_client.channel != channel:
+            await voice_client.move_to(channel)
+        return voice_client
+
+    async def play(self, server: discord.Server, channel: discord.Channel,
+                   path: str, *, options=DEFAULT_OPTIONS,
+                   idle_seconds=None) -> bool:
+        """
+        Waits for the sounds queued before this one, then plays path in 
+        channel and returns once it is over or stopped
+        :param server: discord server
+        :param channel: voice channel to play in
+        :param path: audio file ffmpeg can read
+        :param options: ffmpeg options
+        :param idle_seconds: silence after this sound before leaving voice,
+        the manager's default if None
+        :return: False if channel can't be played in
+        """
+        if channel is None or channel.is_private:
+            return False
+        async with self.locks[server.id]:
+            if self.voice_channel_full(channel):
+                return False
+            voice_client = await self._connect(server, channel)
+            if idle_seconds is None:
+                idle_seconds = self.idle_seconds
+            done = self.players_done[server.id] = self.loop.create_future()
+            loop = self.loop
+            # after is called from the player's thread when it ends or stops
+            player = voice_client.create_ffmpeg_player(
+                path, options=options,
+                after=lambda player: loop.call_soon_threadsafe(
+                    self._player_finished, server, done, idle_seconds))
+            self.players[server.id] = player
+            player.start()
+            await asyncio.shield(done)
+        return True
+
+    async def wait_until_done(self, server: discord.Server):
+        done = self.players_done.get(server.id)
+        if done is not None:
+            await asyncio.shield(done)
+
+    def stop(self, server: discord.Server):
+        """
+        ends the sound playing, the next queued one starts
+        """
+        player = self.players.get(server.id)
+        if player is not None:
+            player.stop()
+
+    async def disconnect(self, server: discord.Server):
+        # forget the player first so stopping it doesn't arm the idle timer
+        self.players_done.pop(server.id, None)
+        self._cancel_idle(server)
+        player = self.players.pop(server.id, None)
+        if player is not None:
+            player.stop()
+        if self.voice_connected(server):
+            await self.voice_client(server).disconnect()
+
+    def _player_finished(self, server: discord.Server, done, idle_seconds):
+        if done.done():
+            return
+        done.set_result(None)
+        if self.players_done.get(server.id) is done and idle_seconds > 0:
+            self._cancel_idle(server)
+            self.idle_timers[server.id] = self.loop.call_later(
+                idle_seconds, self._idle, server, done)
+
+    def _idle(self, server: discord.Server, done):
+        self.idle_timers.pop(server.id, None)
+        self.loop.create_task(self._leave_idle(server, done))
+
+    async def _leave_idle(self, server: discord.Server, done):
+        async with self.locks[server.id]:
+            # something played since the timer was armed
+            if self.players_done.get(server.id) is done:
+                await self.disconnect(server)
+
+    def _cancel_idle(self, server: discord.Server):
+        idle_timer = self.idle_timers.pop(server.id, None)
+        if idle_timer is not None:
+            idle_timer.cancel()
+
+    def close(self):
+        self.players_done.clear()
+        for idle_timer in self.idle_timers.values():
+            idle_timer.cancel()
+        self.idle_timers.clear()
+        for player in self.players.values():
+            player.stop()
+
 
 class TestBot:
     def __init__(self, bot):
         self.bot = bot
         self.description = "Wasdf"
+        self.voice = VoiceManager(bot)
+
+    def __unload(self):
+        self.voice.close()
 
     @commands.group(name="testicular", pass_context=True)
     async def _testicular(self, ctx):
@@ -31,38 +178,6 @@ class TestBot:
         author = ctx.message.author
         await self.bot.say("test message")
 
-    @commands.command(pass_context=True, no_pm=True, name='get_in_here')
-    async def get_in_here(self, ctx: commands.Context):
-        author = ctx.message.author
-        server = ctx.message.server
-        voice_channel = author.voice_channel
-        if self.bot.get_channel(server.id) is None or self.bot.get_channel(
-                server.id) is not voice_channel:
-            try:
-                await self.bot.say("hello")
-                voice_client = await self.bot.join_voice_channel(voice_channel)
-                await self.bot.say(str(voice_client.socket))
-                await self.bot.say("hello2")
-                x = None
-                index = 0
-                while index < 100:
-                    await self.bot.say("Index : " + str(index))
-                    index += 1
-                    try:
-                        x = voice_client.socket.recvfrom(256)
-                        await self.bot.say([x[0][i] for i in range(len(x[0]))])
-                    except Exception:
-                        pass
-                    await self.bot.say(str(x[1]) + str(len(x[0])) if x is not None else "None")
-
-                # await asyncio.wait_for(
-                #     self.bot.join_voice_channel(voice_channel), timeout=5,
-                #     loop=self.bot.loop)
-            except asyncio.futures.TimeoutError as e:
-                raise ConnectionError(
-                    "Error connecting to voice channel; " + e)
-
-
 
 def setup(bot):
     n = TestBot(bot)
@@ -7,78 +7,52 @@ import speech_recognition as sr
 from .utils import checks
 
 
-class SoundPlayer:
-    def __init__(self, bot):
-        self.bot = bot
-        self.audio_players = {}
-
-    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
-        return (voice_channel.user_limit != 0 and
-                len(voice_channel.voice_members) >= voice_channel.user_limit)
-
-    def voice_connected(self, server: discord.Server) -> bool:
-        return self.bot.is_voice_connected(server)
-
-    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
-        return self.bot.voice_client_in(server)
-
-    async def _leave_voice_channel(self, server: discord.Server):
-        if not self.voice_connected(server):
-            return
-        voice_client = self.voice_client(server)
-
-        if server.id in self.audio_players:
-            self.audio_players[server.id].stop()
-        await voice_client.disconnect()
-
-    async def wait_for_disconnect(self, server: discord.Server):
-        while not self.audio_players[server.id].is_done():
-            await asyncio.sleep(0.01)
-        await self._leave_voice_channel(server)
-
-    async def sound_init(self, server: discord.Server, path: str):
-        options = "-filter \"volume=volume=1.00\""
-        voice_client = self.voice_client(server)
-        self.audio_players[server.id] = voice_client.create_ffmpeg_player(
-            path, options=options)
-
-    async def sound_play(self, server: discord.Server,
-                         channel: discord.Channel, p: str):
-        if self.voice_channel_full(channel):
-            return
-
-        if not channel.is_private:
-            if self.voice_connected(server):
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-            else:
-                await self.bot.join_voice_channel(channel)
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-
-
 class TalkBack:
     def __init__(self, bot):
         self.bot = bot
         self.recognizer = sr.Recognizer()
+        self.save_path = os.path.join("data", "talk-back")
+        if not os.path.exists(self.save_path):
+            os.makedirs(self.save_path)
+        self.dependencies = ["snakecogutils"]
+        self._load_dependencies()
+
+    @property
+    def voice(self):
+        """
+        :return: the VoiceManager shared by the cogs, None if snakecogutils 
+        isn't loaded
+        """
+        utils = self.bot.get_cog("TestBot")
+        return utils.voice if utils is not None else None
+
+    def _load_dependencies(self):
+        owner = self.bot.get_cog("Owner")
+        for cogname in self.dependencies:
+            if owner is None or "cogs." + cogname in self.bot.extensions:
+                continue
+            try:
+                owner._load_cog("cogs." + cogname)
+            except Exception as exception:
+                print("Could not load {} for talk-back: {}".format(cogname,
+                                                                  exception))
 
     async def speak(self, audio_string, ctx):
-        sp = SoundPlayer(self.bot)
+        voice = self.voice
+        if voice is None:
+            print("talk-back speaks through snakecogutils, load it first")
+            return
+        # one file per message, a queued reply must not overwrite the one
+        # playing
+        path = os.path.join(self.save_path,
+                            "{}.mp3".format(ctx.message.id))
         tts = gTTS(text=audio_string, lang='en')
-        tts.save("audio.mp3")
-        await sp.sound_play(ctx.message.server, ctx.message.author.voice_channel, "audio.mp3")
+        await self.bot.loop.run_in_executor(None, tts.save, path)
+        try:
+            await voice.play(ctx.message.server,
+                             ctx.message.author.voice_channel, path)
+        finally:
+            os.remove(path)
 
     def record_audio(self):
         with sr.Microphone() as source:
@@ -107,8 +81,12 @@ class TalkBack:
         server = ctx.message.server
         voice_channel = author.voice_channel
         if self.bot.get_channel(server.id) is None or self.bot.get_channel(server.id) is not voice_channel:
+            voice = self.voice
+            if voice is None:
+                print("talk-back listens through snakecogutils, load it first")
+                return
             try:
-                await asyncio.wait_for(self.bot.join_voice_channel(voice_channel), timeout=5, loop=self.bot.loop)
+                await asyncio.wait_for(voice.connect(server, voice_channel), timeout=5, loop=self.bot.loop)
             except asyncio.futures.TimeoutError as e:
                 raise ConnectionError("Error connecting to voice channel; " + e)
         data = self.record_audio()
@@ -1,9 +1,11 @@
 import discord
 from discord.ext import commands
 from cogs.utils.dataIO import dataIO
-from collections import namedtuple, defaultdict, deque
-from datetime import datetime
+from collections import namedtuple, defaultdict, deque, OrderedDict
+from datetime import datetime, timedelta
 from copy import deepcopy
+from functools import lru_cache
+from types import MappingProxyType
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
 from enum import Enum
@@ -13,28 +15,1735 @@ import time
 import logging
 import random
 import asyncio
+import json
+import sqlite3
+import heapq
+import calendar
+import mmap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, insort
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUMPY_MISSING = ("Column indexes require numpy, install it with: "
+                 "pip3 install numpy")
+MSGPACK_MISSING = ("The msgpack snapshot format requires msgpack, install it "
+                   "with: pip3 install msgpack")
 
 
 class InvalidTransactionException(Exception):
     def __init__(self, user_item_dict):
         exception_string = "Invalid transaction with: "
-        for key, value in user_item_dict:
+        for key, value in user_item_dict.items():
             exception_string += "{{{}:{}}}".format(key, value)
         super().__init__(self, exception_string)
 
 class AccountExistsExcpeption(Exception):
     pass
 
+class NoAccountException(Exception):
+    pass
+
+
+@lru_cache(maxsize=65536)
+def parse_timestamp(timestamp):
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+
+
+class Account:
+    """
+    Read only view of a vault account. metadata and storage are views onto 
+    the stored dictionaries rather than copies, mutations go through the 
+    VaultClass withdraw/deposit/transfer/set_* methods instead
+    """
+    __slots__ = ("userid", "server", "name", "metadata", "storage")
+
+    def __init__(self, userid, server, name, account):
+        set_attribute = object.__setattr__
+        set_attribute(self, "userid", userid)
+        set_attribute(self, "server", server)
+        set_attribute(self, "name", name)
+        set_attribute(self, "metadata", MappingProxyType(account["metadata"]))
+        set_attribute(self, "storage", MappingProxyType(account["storage"]))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Account is read only")
+
+    def __delattr__(self, key):
+        raise AttributeError("Account is read only")
+
+    def __getitem__(self, key):
+        # legacy dictionary style access, ie account["storage"]
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    @property
+    def member(self):
+        return self.server.get_member(self.userid)
+
+    @property
+    def created_at(self):
+        return parse_timestamp(self.metadata["created_at"])
+
+    def __repr__(self):
+        return "Account({}.{}:{})".format(self.server.id, self.userid,
+                                          self.name)
+
+SNAPSHOT_VERSION = 1
+
+
+def timestamp_to_int(timestamp):
+    return calendar.timegm(parse_timestamp(timestamp).timetuple())
+
+
+@lru_cache(maxsize=4096)
+def _day_string(day):
+    return (datetime(1970, 1, 1) + timedelta(days=day)).strftime("%Y-%m-%d")
+
+
+def int_to_timestamp(seconds):
+    # built from a cached date and plain arithmetic, strftime per account
+    # would dominate materialization
+    day, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return "{} {:02d}:{:02d}:{:02d}".format(_day_string(day), hours,
+                                             minutes, seconds)
+
+
+class _ColumnTableWriter:
+    def __init__(self, intern):
+        self.intern = intern
+        self.shape_ids = {}
+        self.shapes = []
+        self.values = []
+        self.row_shape = []
+        self.row_position = []
+
+    def add(self, mapping):
+        keys = tuple(mapping)
+        shape_id = self.shape_ids.get(keys)
+        if shape_id is None:
+            shape_id = self.shape_ids[keys] = len(self.shapes)
+            self.shapes.append([self.intern(key) for key in keys])
+            self.values.append([[] for key in keys])
+        columns = self.values[shape_id]
+        self.row_shape.append(shape_id)
+        self.row_position.append(len(columns[0]) if columns else 0)
+        for column, value in zip(columns, mapping.values()):
+            column.append(value)
+
+    def pack(self):
+        return {"shape": self.row_shape, "position": self.row_position,
+                "shapes": self.shapes, "values": self.values}
+
+
+def encode_snapshot(accounts):
+    """
+    packs a shard, {user:{account_name:{"metadata", "storage"}}}, into the 
+    compact binary snapshot format. Accounts are stored as columns: rows
+    grouped by user, account names and metadata/storage keys interned in a
+    string table, one value column per key per key layout, and created_at
+    as integer seconds. Decoding is then a handful of large flat lists
+    :param accounts: shard accounts, a dict or ColumnarAccounts
+    :return: bytes
+    """
+    if msgpack is None:
+        raise RuntimeError(MSGPACK_MISSING)
+    strings = {}
+
+    def intern(string):
+        index = strings.get(string)
+        if index is None:
+            index = strings[string] = len(strings)
+        return index
+
+    users, user_start, names, created = [], [], [], []
+    metadata_table = _ColumnTableWriter(intern)
+    storage_table = _ColumnTableWriter(intern)
+    for user_id, user_accounts in accounts.items():
+        users.append(user_id)
+        user_start.append(len(names))
+        for account_name, account in user_accounts.items():
+            if not account:
+                continue
+            account_metadata = dict(account.get("metadata", {}))
+            created_at = account_metadata.pop("created_at", None)
+            names.append(intern(account_name))
+            created.append(-1 if created_at is None
+                           else timestamp_to_int(created_at))
+            metadata_table.add(account_metadata)
+            storage_table.add(account.get("storage", {}))
+    user_start.append(len(names))
+    return msgpack.packb({"version": SNAPSHOT_VERSION,
+                          "strings": list(strings),
+                          "users": users,
+                          "user_start": user_start,
+                          "names": names,
+                          "created_at": created,
+                          "metadata": metadata_table.pack(),
+                          "storage": storage_table.pack()},
+                         use_bin_type=True)
+
+
+class ColumnarAccounts:
+    def __init__(self, columns, user_positions=None, materialized=None):
+        """
+        {user:{account_name:account}} mapping backed by the decoded columns 
+        of a binary snapshot. A user's accounts are only turned into 
+        dictionaries the first time they are accessed, so loading a shard 
+        costs a few list decodes no matter how many accounts it holds. 
+        Supports the subset of dict used by the json backend
+        :param columns: decoded snapshot
+        :param user_positions: user id -> position in the users column for
+        users not materialized yet
+        :param materialized: user id -> accounts already materialized or set
+        """
+        self.columns = columns
+        self.strings = columns["strings"]
+        if user_positions is None:
+            user_positions = dict(zip(columns["users"],
+                                      range(len(columns["users"]))))
+        self.user_positions = user_positions
+        self.materialized = materialized if materialized is not None else {}
+        self._shape_keys = {}
+
+    def _keys(self, table_name, shape_id):
+        keys = self._shape_keys.get((table_name, shape_id))
+        if keys is None:
+            keys = self._shape_keys[(table_name, shape_id)] = [
+                self.strings[index]
+                for index in self.columns[table_name]["shapes"][shape_id]]
+        return keys
+
+    def _row(self, table_name, row):
+        table = self.columns[table_name]
+        shape_id = table["shape"][row]
+        position = table["position"][row]
+        return {key: column[position] for key, column in
+                zip(self._keys(table_name, shape_id),
+                    table["values"][shape_id])}
+
+    def _materialize(self, user_id):
+        position = self.user_positions.pop(user_id)
+        user_start = self.columns["user_start"]
+        user_accounts = {}
+        for row in range(user_start[position], user_start[position + 1]):
+            metadata = self._row("metadata", row)
+            created_at = self.columns["created_at"][row]
+            if created_at >= 0:
+                metadata["created_at"] = int_to_timestamp(created_at)
+            user_accounts[self.strings[self.columns["names"][row]]] = {
+                "metadata": metadata, "storage": self._row("storage", row)}
+        self.materialized[user_id] = user_accounts
+        return user_accounts
+
+    def get(self, user_id, default=None):
+        user_accounts = self.materialized.get(user_id)
+        if user_accounts is not None:
+            return user_accounts
+        if user_id in self.user_positions:
+            return self._materialize(user_id)
+        return default
+
+    def __getitem__(self, user_id):
+        user_accounts = self.get(user_id)
+        if user_accounts is None:
+            raise KeyError(user_id)
+        return user_accounts
+
+    def __setitem__(self, user_id, user_accounts):
+        self.user_positions.pop(user_id, None)
+        self.materialized[user_id] = user_accounts
+
+    def setdefault(self, user_id, default=None):
+        user_accounts = self.get(user_id)
+        if user_accounts is None:
+            user_accounts = self[user_id] = default
+        return user_accounts
+
+    def __contains__(self, user_id):
+        return user_id in self.materialized or user_id in self.user_positions
+
+    def __len__(self):
+        return len(self.materialized) + len(self.user_positions)
+
+    def __iter__(self):
+        return iter(list(self.materialized) + list(self.user_positions))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        for user_id in list(self.user_positions):
+            self._materialize(user_id)
+        return self.materialized.items()
+
+    def snapshot(self):
+        """
+        :return: a copy that stays stable while this mapping keeps changing,
+        columns are shared since they are never modified
+        """
+        return ColumnarAccounts(
+            self.columns, dict(self.user_positions),
+            {user_id: dict(user_accounts)
+             for user_id, user_accounts in self.materialized.items()})
+
+
+def decode_snapshot(buffer):
+    """
+    inverse of encode_snapshot
+    :param buffer: bytes or any buffer, ie an mmap of the snapshot file
+    :return: ColumnarAccounts
+    """
+    if msgpack is None:
+        raise RuntimeError(MSGPACK_MISSING)
+    columns = msgpack.unpackb(buffer, raw=False)
+    if columns.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported vault snapshot version {}".format(
+            columns.get("version")))
+    return ColumnarAccounts(columns)
+
+
+def load_snapshot(snapshot_path):
+    """
+    reads a binary snapshot through a read only memory map, so the file is
+    decoded straight from the page cache without an intermediate copy
+    :param snapshot_path: file path to the binary snapshot
+    :return: ColumnarAccounts, or an empty dict for an empty file
+    """
+    with open(snapshot_path, "rb") as snapshot_file:
+        if os.fstat(snapshot_file.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(snapshot_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as buffer:
+            return decode_snapshot(buffer)
+
+
+def save_snapshot(snapshot_path, accounts):
+    temp_path = snapshot_path + ".tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(encode_snapshot(accounts))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, snapshot_path)
+
+
+def snapshot_copy(accounts):
+    """
+    copy of shard accounts that is safe to write from another thread, 
+    accounts are replaced rather than mutated in place so copying the user
+    level is enough
+    :param accounts: dict or ColumnarAccounts
+    :return: copy of the same type
+    """
+    if isinstance(accounts, ColumnarAccounts):
+        return accounts.snapshot()
+    return {user_id: dict(user_accounts)
+            for user_id, user_accounts in accounts.items()}
+
+
+def convert_snapshot(source_path, destination_path):
+    """
+    converts a shard snapshot between json and the binary format, the 
+    direction is picked from the file extensions (.json / .msgpack)
+    :param source_path: snapshot to read
+    :param destination_path: snapshot to write
+    :return: number of users converted
+    """
+    if source_path.endswith(".msgpack"):
+        accounts = load_snapshot(source_path)
+    else:
+        accounts = dataIO.load_json(source_path)
+    if destination_path.endswith(".msgpack"):
+        save_snapshot(destination_path, accounts)
+    else:
+        dataIO.save_json(destination_path, dict(accounts.items()))
+    return len(accounts)
+
+
+class VaultJournal:
+    def __init__(self, snapshot_path, compact_threshold=1000,
+                 snapshot_format="json"):
+        """
+        Append-only log of vault mutations kept beside the json snapshot. Each
+        entry stores a path into the {server:{user:{account}}} tree and the
+        value set at that path, so a mutation costs one appended line instead
+        of a rewrite of the whole snapshot
+        :param snapshot_path: file path to the json snapshot
+        :param compact_threshold: number of journal entries after which the 
+        journal should be folded back into the snapshot
+        :param snapshot_format: "json", or "msgpack" to compact into the 
+        binary snapshot beside snapshot_path (.msgpack) instead. An existing
+        json snapshot is still read and replaced on the next compaction
+        """
+        if snapshot_format == "msgpack" and msgpack is None:
+            raise RuntimeError(MSGPACK_MISSING)
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + ".journal"
+        self.snapshot_format = snapshot_format
+        self.binary_path = os.path.splitext(snapshot_path)[0] + ".msgpack"
+        self.compact_threshold = compact_threshold
+        self.pending = []
+        self.staged_snapshot = None
+        self.entry_count = 0
+        # lock guards the queues, io_lock keeps writes to the files in order
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+
+    def load(self):
+        """
+        loads the snapshot and replays any journal entries written since the
+        last compaction on top of it. A torn tail left by a crash mid-append 
+        is cut off, so the next append starts on a fresh line
+        :return: current vault data
+        """
+        data = {}
+        if os.path.exists(self.binary_path):
+            data = load_snapshot(self.binary_path)
+        elif os.path.exists(self.snapshot_path):
+            data = dataIO.load_json(self.snapshot_path)
+        if not os.path.exists(self.journal_path):
+            return data
+        # offset just past the last entry that was read back intact
+        good_end = 0
+        with open(self.journal_path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # a torn final line from a crash mid-append, everything
+                    # before it is still valid
+                    print("Skipping corrupt journal entry in {}".format(
+                        self.journal_path))
+                    continue
+                if "batch" in entry:
+                    for path, value in entry["batch"]:
+                        apply_journal_entry(data, path, value)
+                else:
+                    apply_journal_entry(data, entry["path"], entry["value"])
+                self.entry_count += 1
+                good_end = journal_file.tell()
+            journal_size = journal_file.tell()
+        if good_end < journal_size:
+            with open(self.journal_path, "r+b") as journal_file:
+                journal_file.truncate(good_end)
+        return data
+
+    def _ends_mid_line(self):
+        try:
+            with open(self.journal_path, "rb") as journal_file:
+                journal_file.seek(0, os.SEEK_END)
+                if journal_file.tell() == 0:
+                    return False
+                journal_file.seek(-1, os.SEEK_END)
+                return journal_file.read(1) != b"\n"
+        except FileNotFoundError:
+            return False
+
+    def append(self, path, value):
+        """
+        queues a mutation to be written on the next flush
+        :param path: list of keys into the vault tree
+        :param value: value stored at path
+        :return: 
+        """
+        self._queue(json.dumps({"path": path, "value": value}))
+
+    def append_batch(self, batch):
+        """
+        queues several mutations as one journal line, replayed all or nothing
+        :param batch: list of [path, value]
+        :return: 
+        """
+        self._queue(json.dumps({"batch": batch}))
+
+    def _queue(self, line):
+        with self.lock:
+            self.pending.append(line)
+        self.entry_count += 1
+
+    def needs_compaction(self):
+        return self.entry_count >= self.compact_threshold
+
+    def stage_compaction(self, data):
+        """
+        schedules data to be written as the new snapshot on the next write,
+        replacing the journal. data must already contain every journaled 
+        mutation and must not be mutated afterwards
+        :param data: current vault data
+        :return: 
+        """
+        with self.lock:
+            self.staged_snapshot = data
+            self.pending = []
+        self.entry_count = 0
+
+    def write(self):
+        """
+        writes out whatever is staged or pending, safe to call from a 
+        PersistenceWriter worker thread while the event loop keeps queueing
+        entries. If the io fails the snapshot and lines are queued again for
+        the next write before the error is raised
+        :return: 
+        """
+        with self.io_lock:
+            with self.lock:
+                snapshot, self.staged_snapshot = self.staged_snapshot, None
+                lines, self.pending = self.pending, []
+            try:
+                if snapshot is not None:
+                    self._save_snapshot(snapshot)
+                    open(self.journal_path, "w").close()
+                    snapshot = None
+                if lines:
+                    # never glue the first entry onto an unterminated line
+                    prefix = "\n" if self._ends_mid_line() else ""
+                    with open(self.journal_path, "a",
+                              encoding="utf-8") as journal_file:
+                        journal_file.write(prefix + "\n".join(lines) + "\n")
+                        journal_file.flush()
+                        os.fsync(journal_file.fileno())
+            except Exception:
+                with self.lock:
+                    # a compaction staged meanwhile already holds all of it
+                    if self.staged_snapshot is None:
+                        self.staged_snapshot = snapshot
+                        self.pending = lines + self.pending
+                raise
+
+    def _save_snapshot(self, snapshot):
+        if self.snapshot_format == "msgpack":
+            save_snapshot(self.binary_path, snapshot)
+            if os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
+        else:
+            dataIO.save_json(self.snapshot_path, dict(snapshot.items()))
+            if os.path.exists(self.binary_path):
+                os.remove(self.binary_path)
+
+    def flush(self):
+        """
+        appends all queued mutations to the journal file
+        :return: 
+        """
+        self.write()
+
+    def compact(self, data):
+        """
+        writes data as the new snapshot and truncates the journal, data must
+        already contain every journaled mutation
+        :param data: current vault data
+        :return: 
+        """
+        self.stage_compaction(data)
+        self.write()
+
+
+def apply_journal_entry(data, path, value):
+    """
+    sets value at path inside the nested vault dictionary, creating any 
+    missing intermediate dictionaries
+    :param data: vault dictionary
+    :param path: list of keys
+    :param value: value to set
+    :return: 
+    """
+    node = data
+    for key in path[:-1]:
+        node = node.setdefault(key, {})
+    node[path[-1]] = value
+
+
+class PersistenceWriter:
+    def __init__(self, loop, max_workers=2):
+        """
+        Runs file writes on a thread pool so serializing and fsyncing never 
+        blocks the event loop. Writes are keyed (ie by file path): at most one
+        write per key runs at a time, and any number of submissions made 
+        while one is queued collapse into that single queued write, so a 
+        burst of saves costs one write of the latest state
+        :param loop: event loop the returned futures belong to
+        :param max_workers: writer threads
+        """
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.queued = OrderedDict()
+        self.waiters = {}
+        self.running = {}
+
+    def submit(self, key, write):
+        """
+        queues write to run in a worker thread, replacing any queued but not
+        yet started write for the same key
+        :param key: identifies the file being written
+        :param write: callable taking no arguments that does the io
+        :return: future resolved once a write started after this call 
+        completes, await it for durability
+        """
+        future = self.loop.create_future()
+        self.queued[key] = write
+        self.waiters.setdefault(key, []).append(future)
+        if key not in self.running:
+            self._start(key)
+        return future
+
+    def _start(self, key):
+        write = self.queued.pop(key)
+        waiters = self.waiters.pop(key, [])
+        running = self.loop.run_in_executor(self.executor, write)
+        self.running[key] = running
+        running.add_done_callback(
+            lambda done: self._finished(key, done, waiters))
+
+    def _finished(self, key, done, waiters):
+        del self.running[key]
+        exception = done.exception()
+        if exception is not None:
+            print("Background write of {} failed: {}".format(key, exception))
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exception is not None:
+                waiter.set_exception(exception)
+            else:
+                waiter.set_result(None)
+        if key in self.queued:
+            self._start(key)
+
+    def close(self):
+        """
+        waits for running writes and runs every queued write synchronously,
+        called on unload so nothing submitted is lost
+        :return: 
+        """
+        self.executor.shutdown(wait=True)
+        while self.queued:
+            key, write = self.queued.popitem(last=False)
+            write()
+            for waiter in self.waiters.pop(key, []):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+
+class VaultShard:
+    def __init__(self, shard_path, compact_threshold, snapshot_format="json"):
+        """
+        One server's slice of a json vault, {user:{account}}, with its own 
+        snapshot and journal
+        :param shard_path: file path to the shard json
+        :param compact_threshold: journal entries before the snapshot is 
+        rewritten
+        :param snapshot_format: "json" or "msgpack", see VaultJournal
+        """
+        self.journal = VaultJournal(shard_path, compact_threshold,
+                                    snapshot_format)
+        self.accounts = self.journal.load()
+        self.last_access = time.monotonic()
+
+    def flush(self, writer=None):
+        """
+        writes pending journal entries, compacting the journal into the 
+        snapshot once it grows past its threshold
+        :param writer: PersistenceWriter to do the file io on, written 
+        synchronously when None
+        :return: future completing once written when a writer is given
+        """
+        if self.journal.needs_compaction():
+            self.journal.stage_compaction(snapshot_copy(self.accounts))
+        if writer is None:
+            self.journal.write()
+            return None
+        return writer.submit(self.journal.snapshot_path, self.journal.write)
+
+
+def shard_server_ids(shard_directory):
+    """
+    :param shard_directory: folder of a sharded json vault
+    :return: set of server ids with a shard on disk, including shards that
+    were never compacted and only exist as a journal
+    """
+    server_ids = set()
+    for file_name in os.listdir(shard_directory):
+        server_id, extension = os.path.splitext(file_name)
+        if extension == ".journal":
+            server_id, extension = os.path.splitext(server_id)
+            if extension != ".json":
+                continue
+        elif extension not in (".json", ".msgpack"):
+            continue
+        server_ids.add(server_id)
+    return server_ids
+
+
+class JsonVaultBackend:
+    def __init__(self, vault_path, compact_threshold=1000,
+                 max_loaded_shards=256, shard_idle_seconds=600,
+                 snapshot_format="json"):
+        """
+        Stores each server's accounts in its own json shard beside vault_path
+        (data/vault/bank.json -> data/vault/bank/<server id>.json). Shards are
+        loaded on first access, persisted independently through their own
+        journal and evicted once idle or once more than max_loaded_shards are
+        loaded, least recently used first. An existing monolithic vault file 
+        is split into shards on first start
+        :param vault_path: file path to accounts json
+        :param compact_threshold: journal entries before a shard snapshot is 
+        rewritten
+        :param max_loaded_shards: most shards kept in memory at once
+        :param shard_idle_seconds: seconds without access before a shard is 
+        evicted
+        :param snapshot_format: "json", or "msgpack" for compact binary shard
+        snapshots that load much faster (requires msgpack)
+        """
+        if snapshot_format == "msgpack" and msgpack is None:
+            raise RuntimeError(MSGPACK_MISSING)
+        self.shard_directory = os.path.splitext(vault_path)[0]
+        self.snapshot_format = snapshot_format
+        self.compact_threshold = compact_threshold
+        self.max_loaded_shards = max_loaded_shards
+        self.shard_idle_seconds = shard_idle_seconds
+        self.shards = OrderedDict()
+        create_folder_if_none(self.shard_directory)
+        self._split_monolithic(vault_path)
+
+    def _split_monolithic(self, vault_path):
+        if not os.path.exists(vault_path):
+            return
+        accounts = VaultJournal(vault_path).load()
+        if not accounts:
+            return
+        for server_id, users in accounts.items():
+            shard_journal = VaultJournal(self._shard_path(server_id),
+                                         snapshot_format=self.snapshot_format)
+            if not (os.path.exists(shard_journal.snapshot_path) or
+                    os.path.exists(shard_journal.binary_path)):
+                shard_journal.compact(users)
+        os.replace(vault_path, vault_path + ".migrated")
+        if os.path.exists(vault_path + ".journal"):
+            os.remove(vault_path + ".journal")
+        print("Split {} into {} server shards in {}".format(
+            vault_path, len(accounts), self.shard_directory))
+
+    def _shard_path(self, server_id):
+        return os.path.join(self.shard_directory, "{}.json".format(server_id))
+
+    def _shard(self, server_id):
+        shard = self.shards.get(server_id)
+        if shard is None:
+            shard = VaultShard(self._shard_path(server_id),
+                               self.compact_threshold, self.snapshot_format)
+            self.shards[server_id] = shard
+            while len(self.shards) > self.max_loaded_shards:
+                self._evict(next(iter(self.shards)))
+        else:
+            self.shards.move_to_end(server_id)
+            shard.last_access = time.monotonic()
+        return shard
+
+    def _evict(self, server_id):
+        # only the journal tail is written, compaction waits until the shard
+        # is loaded again
+        shard = self.shards.pop(server_id)
+        shard.journal.flush()
+
+    def get_account(self, server_id, user_id, account_name):
+        return self._shard(server_id).accounts.get(user_id, {}).get(
+            account_name)
+
+    def get_user_accounts(self, server_id, user_id):
+        return self._shard(server_id).accounts.get(user_id, {})
+
+    def iter_server_accounts(self, server_id):
+        accounts = self._shard(server_id).accounts
+        for user_id, user_accounts in list(accounts.items()):
+            for account_name, account in user_accounts.items():
+                yield user_id, account_name, account
+
+    def server_ids(self):
+        server_ids = set(server_id for server_id, shard in self.shards.items()
+                         if shard.accounts)
+        server_ids.update(shard_server_ids(self.shard_directory))
+        return list(server_ids)
+
+    def set_account(self, server_id, user_id, account_name, account):
+        shard = self._shard(server_id)
+        path = [user_id, account_name]
+        apply_journal_entry(shard.accounts, path, account)
+        shard.journal.append(path, account)
+
+    def set_accounts(self, entries):
+        """
+        sets several accounts under a single journal entry per shard so a 
+        crash can never leave only part of a server's batch applied
+        :param entries: list of (server_id, user_id, account_name, account)
+        :return: 
+        """
+        batches = OrderedDict()
+        for server_id, user_id, account_name, account in entries:
+            shard = self._shard(server_id)
+            path = [user_id, account_name]
+            apply_journal_entry(shard.accounts, path, account)
+            batches.setdefault(server_id, []).append([path, account])
+        for server_id, batch in batches.items():
+            self._shard(server_id).journal.append_batch(batch)
+
+    def delete_accounts(self, server_id, user_id=None, account_name=None):
+        shard = self._shard(server_id)
+        if user_id is None and account_name is None:
+            shard.accounts = {}
+            shard.journal.compact(shard.accounts)
+            return
+        if user_id is None:
+            # one account type across the server, as a single batch
+            batch = [[[other_id, account_name], {}]
+                     for other_id, user_accounts in shard.accounts.items()
+                     if user_accounts.get(account_name)]
+            for path, value in batch:
+                apply_journal_entry(shard.accounts, path, value)
+            if batch:
+                shard.journal.append_batch(batch)
+            return
+        path = [key for key in (user_id, account_name) if key is not None]
+        apply_journal_entry(shard.accounts, path, {})
+        shard.journal.append(path, {})
+
+    def flush(self, writer=None):
+        """
+        flushes every loaded shard and evicts the ones idle for longer than 
+        shard_idle_seconds
+        :param writer: PersistenceWriter to do the file io on, written 
+        synchronously when None
+        :return: list of futures completing once each shard is written
+        """
+        idle_before = time.monotonic() - self.shard_idle_seconds
+        futures = []
+        for server_id, shard in list(self.shards.items()):
+            if shard.last_access < idle_before:
+                self._evict(server_id)
+            else:
+                future = shard.flush(writer)
+                if future is not None:
+                    futures.append(future)
+        return futures
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.journal.compact(shard.accounts)
+        self.shards.clear()
+
+
+def read_json_vault(vault_path):
+    """
+    reads a json vault (monolithic file and/or server shards) without 
+    splitting, renaming or creating anything, shards win over the 
+    monolithic file like they do when it is split
+    :param vault_path: file path to accounts json
+    :return: {server id: {user id: {account name: account}}}
+    """
+    servers = {}
+    if os.path.exists(vault_path):
+        servers.update(VaultJournal(vault_path).load())
+    shard_directory = os.path.splitext(vault_path)[0]
+    if not os.path.isdir(shard_directory):
+        return servers
+    # journal-only shards are replayed onto an empty snapshot by load
+    for server_id in shard_server_ids(shard_directory):
+        servers[server_id] = VaultJournal(os.path.join(
+            shard_directory, "{}.json".format(server_id))).load()
+    return servers
+
+
+# PRAGMA user_version of a database the json vault was migrated into
+SQLITE_MIGRATED_VERSION = 1
+
+
+class SqliteVaultBackend:
+    def __init__(self, vault_path):
+        """
+        Stores one row per account keyed on (server_id, user_id, 
+        account_name), so point reads and writes never touch the rest of the
+        vault. Writes are committed on flush. The first time the database is
+        created any existing json vault at vault_path is migrated into it
+        :param vault_path: file path to accounts json, the database lives 
+        beside it with a .sqlite3 extension
+        """
+        self.db_path = os.path.splitext(vault_path)[0] + ".sqlite3"
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS accounts ("
+            "server_id TEXT NOT NULL, "
+            "user_id TEXT NOT NULL, "
+            "account_name TEXT NOT NULL, "
+            "metadata TEXT NOT NULL, "
+            "storage TEXT NOT NULL, "
+            "PRIMARY KEY (server_id, user_id, account_name)"
+            ") WITHOUT ROWID")
+        self.connection.commit()
+        self.migrate_json(vault_path)
+
+    def migrate_json(self, vault_path):
+        """
+        one shot import of a json vault (monolithic file or server shards),
+        recorded in the database's user_version so accounts deleted later 
+        are never imported again. The version is only set in the same 
+        commit as the imported rows, a failed read or insert is retried on
+        the next start
+        :param vault_path: file path to accounts json
+        :return: number of accounts migrated
+        """
+        version, = self.connection.execute("PRAGMA user_version").fetchone()
+        if version >= SQLITE_MIGRATED_VERSION:
+            return 0
+        rows = []
+        # databases from before the version was recorded were migrated if
+        # they hold any account
+        if self.connection.execute(
+                "SELECT 1 FROM accounts LIMIT 1").fetchone() is None:
+            for server_id, users in read_json_vault(vault_path).items():
+                for user_id, user_accounts in users.items():
+                    for account_name, account in user_accounts.items():
+                        if account:
+                            rows.append(self._to_row(server_id, user_id,
+                                                     account_name, account))
+        try:
+            self.connection.executemany(
+                "INSERT INTO accounts VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute(
+                "PRAGMA user_version = {}".format(SQLITE_MIGRATED_VERSION))
+            self.connection.commit()
+        except sqlite3.Error:
+            self.connection.rollback()
+            raise
+        if rows:
+            print("Migrated {} accounts from {} to {}".format(
+                len(rows), vault_path, self.db_path))
+        return len(rows)
+
+    @staticmethod
+    def _to_row(server_id, user_id, account_name, account):
+        return (server_id, user_id, account_name,
+                json.dumps(account.get("metadata", {})),
+                json.dumps(account.get("storage", {})))
+
+    @staticmethod
+    def _from_row(metadata, storage):
+        return {"metadata": json.loads(metadata),
+                "storage": json.loads(storage)}
+
+    def get_account(self, server_id, user_id, account_name):
+        row = self.connection.execute(
+            "SELECT metadata, storage FROM accounts "
+            "WHERE server_id = ? AND user_id = ? AND account_name = ?",
+            (server_id, user_id, account_name)).fetchone()
+        if row is None:
+            return None
+        return self._from_row(*row)
+
+    def get_user_accounts(self, server_id, user_id):
+        rows = self.connection.execute(
+            "SELECT account_name, metadata, storage FROM accounts "
+            "WHERE server_id = ? AND user_id = ?", (server_id, user_id))
+        return {account_name: self._from_row(metadata, storage)
+                for account_name, metadata, storage in rows}
+
+    def iter_server_accounts(self, server_id):
+        rows = self.connection.execute(
+            "SELECT user_id, account_name, metadata, storage FROM accounts "
+            "WHERE server_id = ?", (server_id,)).fetchall()
+        for user_id, account_name, metadata, storage in rows:
+            yield user_id, account_name, self._from_row(metadata, storage)
+
+    def server_ids(self):
+        rows = self.connection.execute(
+            "SELECT DISTINCT server_id FROM accounts")
+        return [server_id for server_id, in rows]
+
+    def set_account(self, server_id, user_id, account_name, account):
+        if not account:
+            self.delete_accounts(server_id, user_id, account_name)
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?)",
+            self._to_row(server_id, user_id, account_name, account))
+
+    def set_accounts(self, entries):
+        # rows only become durable on the next commit in flush, so the batch
+        # is committed together
+        for server_id, user_id, account_name, account in entries:
+            self.set_account(server_id, user_id, account_name, account)
+
+    def delete_accounts(self, server_id, user_id=None, account_name=None):
+        query = "DELETE FROM accounts WHERE server_id = ?"
+        params = [server_id]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if account_name is not None:
+            query += " AND account_name = ?"
+            params.append(account_name)
+        self.connection.execute(query, params)
+
+    def flush(self, writer=None):
+        # the connection belongs to the event loop thread, commits are 
+        # small WAL appends so they stay synchronous
+        self.connection.commit()
+        return []
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class ServerIndex:
+    """
+    Accounts of one server kept sorted by descending key value
+    """
+    __slots__ = ("entries", "values")
+
+    def __init__(self, values=None):
+        """
+        :param values: user id -> value to start from, sorted once
+        """
+        self.values = dict(values) if values else {}
+        # entries are (-value, user_id) so ascending order is descending value
+        self.entries = sorted((-value, user_id)
+                              for user_id, value in self.values.items())
+
+    def set(self, user_id, value):
+        self.discard(user_id)
+        if value is None:
+            return
+        insort(self.entries, (-value, user_id))
+        self.values[user_id] = value
+
+    def discard(self, user_id):
+        value = self.values.pop(user_id, None)
+        if value is None:
+            return
+        del self.entries[bisect_left(self.entries, (-value, user_id))]
+
+    def rank(self, user_id):
+        value = self.values.get(user_id)
+        if value is None:
+            return None
+        return bisect_left(self.entries, (-value, user_id)) + 1
+
+
+class AccountIndex:
+    def __init__(self, backend, account_name, key):
+        """
+        Incrementally maintained ordering of one account type by a key taken
+        from the account, ie bank balance. A server's index is built from the
+        backend the first time it is queried and kept up to date by 
+        VaultClass on every write afterwards, it outlives the shard being 
+        evicted so global queries don't rebuild it for every server
+        :param backend: vault backend to build server indexes from
+        :param account_name: account type to index
+        :param key: function of the account dictionary returning a sortable
+        value, or None to leave the account out of the index
+        """
+        self.backend = backend
+        self.account_name = account_name
+        self.key = key
+        self.servers = {}
+
+    def _server(self, server_id):
+        server_index = self.servers.get(server_id)
+        if server_index is None:
+            values = {}
+            for user_id, account_name, account in \
+                    self.backend.iter_server_accounts(server_id):
+                if account_name == self.account_name and account:
+                    value = self.key(account)
+                    if value is not None:
+                        values[user_id] = value
+            server_index = self.servers[server_id] = ServerIndex(values)
+        return server_index
+
+    def update(self, server_id, user_id, account):
+        server_index = self.servers.get(server_id)
+        if server_index is None:
+            # not built yet, the backend already holds the new value
+            return
+        server_index.set(user_id, self.key(account) if account else None)
+
+    def discard(self, server_id, user_id):
+        server_index = self.servers.get(server_id)
+        if server_index is not None:
+            server_index.discard(user_id)
+
+    def drop_server(self, server_id):
+        self.servers.pop(server_id, None)
+
+    def iter_server(self, server_id):
+        """
+        yields (value, user_id) for a server from highest to lowest value
+        :param server_id: discord server id
+        :return: generator
+        """
+        for negative_value, user_id in self._server(server_id).entries:
+            yield -negative_value, user_id
+
+    def iter_global(self, server_ids):
+        """
+        yields (value, server_id, user_id) across the given servers from 
+        highest to lowest value, lazily merging the per server indexes so 
+        only as many entries as are consumed get visited
+        :param server_ids: discord server ids to include
+        :return: generator
+        """
+        streams = [self._tagged_entries(server_id) for server_id in server_ids]
+        for negative_value, server_id, user_id in heapq.merge(*streams):
+            yield -negative_value, server_id, user_id
+
+    def top_global(self, server_ids, top, keep=None):
+        """
+        the highest entries across servers with each user counted once, at
+        their highest value, stopping as soon as top users were found
+        :param server_ids: discord server ids to include
+        :param top: number of users wanted
+        :param keep: function of (server_id, user_id), entries it rejects 
+        are skipped, ie users who left the server
+        :return: list of (value, server_id, user_id)
+        """
+        entries = self.iter_global(server_ids)
+        if keep is not None:
+            entries = (entry for entry in entries if keep(entry[1], entry[2]))
+        return unique_accounts(entries, top, key=lambda entry: entry[2])
+
+    def _tagged_entries(self, server_id):
+        for negative_value, user_id in self._server(server_id).entries:
+            yield negative_value, server_id, user_id
+
+    def rank(self, server_id, user_id):
+        """
+        :param server_id: discord server id
+        :param user_id: discord user id
+        :return: 1 based position of the user on the server, None if the 
+        user has no indexed account
+        """
+        return self._server(server_id).rank(user_id)
+
+    def count(self, server_id):
+        return len(self._server(server_id).entries)
+
+    def rank_among(self, server_id, user_id, user_ids):
+        """
+        rank counting only the accounts of user_ids, ie the server's current
+        members, so departed users holding an account are left out
+        :param server_id: discord server id
+        :param user_id: discord user id
+        :param user_ids: ids of the users to rank against
+        :return: (1 based position or None if the user has no indexed 
+        account, number of indexed accounts among user_ids)
+        """
+        values = self._server(server_id).values
+        value = values.get(user_id)
+        rank = 1
+        count = 0
+        for other_id in user_ids:
+            other_value = values.get(other_id)
+            if other_value is None:
+                continue
+            count += 1
+            if value is not None and (-other_value, other_id) < (-value,
+                                                                 user_id):
+                rank += 1
+        return (rank if value is not None else None), count
+
+
+class ServerColumn:
+    """
+    One server's values of an account type packed into a numpy array, rows
+    are kept dense by moving the last row into any removed slot
+    """
+    __slots__ = ("values", "user_ids", "rows")
+
+    def __init__(self, dtype):
+        self.values = numpy.zeros(16, dtype=dtype)
+        self.user_ids = []
+        self.rows = {}
+
+    def set(self, user_id, value):
+        if value is None:
+            self.discard(user_id)
+            return
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            if row == len(self.values):
+                self.values = numpy.concatenate(
+                    (self.values, numpy.zeros_like(self.values)))
+        self.values[row] = value
+
+    def discard(self, user_id):
+        row = self.rows.pop(user_id, None)
+        if row is None:
+            return
+        last = len(self.user_ids) - 1
+        if row != last:
+            moved = self.user_ids[last]
+            self.user_ids[row] = moved
+            self.values[row] = self.values[last]
+            self.rows[moved] = row
+        self.user_ids.pop()
+
+    def view(self):
+        return self.values[:len(self.user_ids)]
+
+
+class ColumnIndex:
+    def __init__(self, backend, account_name, key, dtype):
+        """
+        numpy mirror of one value per account (ie bank balance) for every
+        server, kept in sync by VaultClass like AccountIndex so aggregates
+        can be computed vectorized without walking the vault
+        :param backend: vault backend to build server columns from
+        :param account_name: account type to mirror
+        :param key: function of the account dictionary returning the value,
+        or None to leave the account out
+        :param dtype: numpy dtype of the column
+        """
+        self.backend = backend
+        self.account_name = account_name
+        self.key = key
+        self.dtype = dtype
+        self.servers = {}
+
+    def _server(self, server_id):
+        column = self.servers.get(server_id)
+        if column is None:
+            column = ServerColumn(self.dtype)
+            for user_id, account_name, account in \
+                    self.backend.iter_server_accounts(server_id):
+                if account_name == self.account_name and account:
+                    column.set(user_id, self.key(account))
+            self.servers[server_id] = column
+        return column
+
+    def update(self, server_id, user_id, account):
+        column = self.servers.get(server_id)
+        if column is None:
+            return
+        column.set(user_id, self.key(account) if account else None)
+
+    def discard(self, server_id, user_id):
+        column = self.servers.get(server_id)
+        if column is not None:
+            column.discard(user_id)
+
+    def drop_server(self, server_id):
+        self.servers.pop(server_id, None)
+
+    def values(self, server_id):
+        """
+        :param server_id: discord server id
+        :return: read only numpy view of the server's values, only valid
+        until the next vault write
+        """
+        view = self._server(server_id).view()
+        view.flags.writeable = False
+        return view
+
+
+VAULT_BACKENDS = {"json": JsonVaultBackend,
+                  "sqlite": SqliteVaultBackend}
+
+
+class AccountLockContext:
+    def __init__(self, locks, keys):
+        """
+        async context manager holding the locks of several accounts, always
+        acquired in sorted key order so two commands locking the same pair
+        of accounts (ie opposite transfers) can't deadlock
+        :param locks: AccountLocks the keys belong to
+        :param keys: (server_id, user_id, account_name) tuples
+        """
+        self.locks = locks
+        self.keys = sorted(set(keys))
+        self.held = []
+
+    async def __aenter__(self):
+        try:
+            for key in self.keys:
+                await self.locks.acquire(key)
+                self.held.append(key)
+        except BaseException:
+            await self.__aexit__(None, None, None)
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        while self.held:
+            self.locks.release(self.held.pop())
+        return False
+
+
+class AccountLocks:
+    def __init__(self):
+        """
+        asyncio locks per (server_id, user_id, account_name), created on first
+        use and dropped once nothing holds or waits on them, along with 
+        contention counters for monitoring
+        """
+        self.locks = {}
+        self.users = defaultdict(int)
+        self.stats = {"acquired": 0, "contended": 0, "wait_seconds": 0.0,
+                      "max_wait_seconds": 0.0}
+        self.contended_keys = defaultdict(int)
+
+    def locked(self, keys):
+        return AccountLockContext(self, keys)
+
+    async def acquire(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.users[key] += 1
+        if lock.locked():
+            self.stats["contended"] += 1
+            self.contended_keys[key] += 1
+            start = time.perf_counter()
+            try:
+                await lock.acquire()
+            except BaseException:
+                self._unuse(key)
+                raise
+            waited = time.perf_counter() - start
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(
+                self.stats["max_wait_seconds"], waited)
+        else:
+            await lock.acquire()
+        self.stats["acquired"] += 1
+
+    def release(self, key):
+        self.locks[key].release()
+        self._unuse(key)
+
+    def _unuse(self, key):
+        self.users[key] -= 1
+        if self.users[key] == 0:
+            del self.users[key]
+            del self.locks[key]
+
+    def most_contended(self, count=5):
+        return sorted(self.contended_keys.items(), key=lambda item: item[1],
+                      reverse=True)[:count]
+
+
+class CooldownStore:
+    def __init__(self, bot, file_path, *, flush_interval=30, writer=None,
+                 clock=time.time):
+        """
+        Cooldowns that survive restarts, keyed by tuples of strings (ie 
+        ("payday", server_id, user_id)). Expiry times are wall clock, checks
+        are a dict lookup and expired keys are popped off a heap ordered by 
+        expiry, so memory only holds cooldowns that are still running
+        :param bot: discord bot object
+        :param file_path: json file the running cooldowns are saved to
+        :param flush_interval: seconds between saves of changed cooldowns
+        :param writer: PersistenceWriter doing the file io off the event
+        loop, None writes synchronously
+        :param clock: function returning the current unix time
+        """
+        self.bot = bot
+        self.file_path = file_path
+        self.writer = writer
+        self.clock = clock
+        self.expiries = {}
+        self.heap = []
+        self._dirty = False
+        self._flush_task = None
+        now = clock()
+        if dataIO.is_valid_json(file_path):
+            for key, expires_at in dataIO.load_json(file_path).items():
+                if expires_at > now:
+                    key = tuple(key.split(":"))
+                    self.expiries[key] = expires_at
+                    self.heap.append((expires_at, key))
+            heapq.heapify(self.heap)
+        self.start_flushing(flush_interval)
+
+    def __len__(self):
+        self._expire(self.clock())
+        return len(self.expiries)
+
+    def _expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self.heap)
+            # entries replaced by a later start stay in the heap, skip them
+            if self.expiries.get(key) == expires_at:
+                del self.expiries[key]
+                self._dirty = True
+
+    def remaining(self, key):
+        """
+        :param key: tuple of strings identifying the cooldown
+        :return: seconds left on the cooldown, 0 if it isn't running
+        """
+        now = self.clock()
+        self._expire(now)
+        expires_at = self.expiries.get(key)
+        if expires_at is None:
+            return 0
+        return expires_at - now
+
+    def start(self, key, seconds):
+        """
+        (re)starts a cooldown, replacing any running one for key
+        :param key: tuple of strings identifying the cooldown
+        :param seconds: cooldown length
+        :return: 
+        """
+        expires_at = self.clock() + seconds
+        self.expiries[key] = expires_at
+        heapq.heappush(self.heap, (expires_at, key))
+        if len(self.heap) > 2 * len(self.expiries) + 64:
+            self.heap = [(expires, cooldown)
+                         for cooldown, expires in self.expiries.items()]
+            heapq.heapify(self.heap)
+        self._dirty = True
+
+    def try_start(self, key, seconds):
+        """
+        starts the cooldown unless it is already running
+        :param key: tuple of strings identifying the cooldown
+        :param seconds: cooldown length
+        :return: 0 if the cooldown was started, otherwise the seconds left
+        """
+        remaining = self.remaining(key)
+        if remaining == 0:
+            self.start(key, seconds)
+        return remaining
+
+    def clear(self, key):
+        if self.expiries.pop(key, None) is not None:
+            self._dirty = True
+
+    def _save(self):
+        """
+        writes the running cooldowns if any changed since the last save
+        :return: future completing once written, None if nothing changed 
+        """
+        self._expire(self.clock())
+        if not self._dirty:
+            return None
+        self._dirty = False
+        data = {":".join(key): expires_at
+                for key, expires_at in self.expiries.items()}
+        path = self.file_path
+        write = lambda: dataIO.save_json(path, data)
+        if self.writer is None:
+            write()
+            return None
+        return self.writer.submit(path, write)
+
+    async def _flush_loop(self, flush_interval):
+        try:
+            while True:
+                await asyncio.sleep(flush_interval)
+                saved = self._save()
+                if saved is None:
+                    continue
+                # the writer reports the failure, save again next time
+                failed, = await asyncio.gather(saved, return_exceptions=True)
+                if failed is not None:
+                    self._dirty = True
+        except asyncio.CancelledError:
+            pass
+
+    def start_flushing(self, flush_interval):
+        if self._flush_task is None and flush_interval > 0:
+            self._flush_task = self.bot.loop.create_task(
+                self._flush_loop(flush_interval))
+
+    def stop_flushing(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def close(self):
+        """
+        stops the flush loop and saves any change through the writer, called
+        when the cog using the store unloads. The store stays usable and is
+        handed back by Vault.get_cooldowns when the cog is loaded again
+        :return: 
+        """
+        self.stop_flushing()
+        self._save()
+
+
+class ServerSettings:
+    """
+    one server's settings as attributes, subclassed by SettingsStore with 
+    the default keys as slots
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, values):
+        for field in self.fields:
+            setattr(self, field, values[field])
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.fields]
+
+
+class SettingsStore:
+    def __init__(self, bot, file_path, defaults, *, save_delay=2,
+                 writer=None):
+        """
+        Per server settings kept in memory with defaults merged in once on 
+        load, so reads are attribute lookups. Changes go through set and are
+        written atomically after save_delay seconds, a burst of changes 
+        costing one write
+        :param bot: discord bot object
+        :param file_path: file path to settings json, {server:{key:value}}
+        :param defaults: {key: default value}, values keep the default's type
+        :param save_delay: seconds to wait for further changes before saving
+        :param writer: PersistenceWriter doing the file io off the event
+        loop, None writes synchronously
+        """
+        self.bot = bot
+        self.file_path = file_path
+        self.save_delay = save_delay
+        self.writer = writer
+        self._save_handle = None
+        data = {}
+        if dataIO.is_valid_json(file_path):
+            data = dataIO.load_json(file_path)
+        self._load(defaults, data)
+
+    def _load(self, defaults, data):
+        self.defaults = dict(defaults)
+        self.settings_type = type("ServerSettings", (ServerSettings,),
+                                  {"__slots__": tuple(self.defaults),
+                                   "fields": tuple(self.defaults)})
+        self.servers = {}
+        # keys no longer in defaults, written back untouched
+        self.unknown = {}
+        for server_id, values in data.items():
+            merged = dict(self.defaults)
+            for key, value in values.items():
+                if key in self.defaults:
+                    merged[key] = self._coerce(key, value)
+                else:
+                    self.unknown.setdefault(server_id, {})[key] = value
+            self.servers[server_id] = self.settings_type(merged)
+
+    def __getitem__(self, server_id):
+        settings = self.servers.get(server_id)
+        if settings is None:
+            settings = self.servers[server_id] = self.settings_type(
+                self.defaults)
+        return settings
+
+    def _coerce(self, key, value):
+        default = self.defaults[key]
+        if default is None or isinstance(value, type(default)):
+            return value
+        return type(default)(value)
+
+    def set(self, server_id, key, value):
+        """
+        changes one setting and schedules a save
+        :param server_id: discord server id
+        :param key: setting name, one of the defaults' keys
+        :param value: new value, converted to the default's type
+        :return: the stored value
+        """
+        if key not in self.defaults:
+            raise KeyError(key)
+        value = self._coerce(key, value)
+        setattr(self[server_id], key, value)
+        if self._save_handle is None:
+            self._save_handle = self.bot.loop.call_later(self.save_delay,
+                                                         self._save)
+        return value
+
+    def set_defaults(self, defaults):
+        """
+        swaps in new defaults (ie a reloaded cog's), keeping every value 
+        that was set
+        :param defaults: {key: default value}
+        :return: 
+        """
+        if defaults != self.defaults:
+            self._load(defaults, self._data())
+
+    def _data(self):
+        data = {server_id: dict(settings.items())
+                for server_id, settings in self.servers.items()}
+        for server_id, values in self.unknown.items():
+            data.setdefault(server_id, {}).update(values)
+        return data
+
+    def _save(self):
+        self._save_handle = None
+        data = self._data()
+        path = self.file_path
+        write = lambda: dataIO.save_json(path, data)
+        if self.writer is None:
+            write()
+            return None
+        saved = self.writer.submit(path, write)
+        saved.add_done_callback(self._saved)
+        return saved
+
+    def _saved(self, saved):
+        # the writer reports the failure, try again after save_delay
+        if (not saved.cancelled() and saved.exception() is not None and
+                self._save_handle is None):
+            self._save_handle = self.bot.loop.call_later(self.save_delay,
+                                                         self._save)
+
+    def close(self):
+        """
+        saves any pending change through the writer, called when the cog 
+        using the store unloads. The store stays usable and is handed back 
+        by Vault.get_settings when the cog is loaded again
+        :return: 
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save()
+
+
+class VaultTransaction:
+    def __init__(self, vault):
+        """
+        Stages changes to any number of accounts and writes them to the vault
+        in one batch when the with block exits cleanly. If the block raises
+        (ie InvalidTransactionException from a withdraw method) nothing is 
+        written and the exception propagates
+        :param vault: VaultClass the transaction belongs to
+        """
+        self.vault = vault
+        self.staged = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.vault._write_accounts(
+                [key + (account,) for key, account in self.staged.items()])
+        self.staged.clear()
+        return False
+
+    def get_account(self, user, account_name):
+        """
+        returns the staged copy of an account, copying it from the vault the
+        first time it is touched in this transaction. Changes made to the 
+        returned dictionary are committed with the transaction
+        :param user: discord user
+        :param account_name: account for user
+        :return: account dictionary {"metadata", "storage"}
+        """
+        key = (user.server.id, user.id, account_name)
+        if key not in self.staged:
+            self.staged[key] = self.vault._get_account(user, account_name)
+        return self.staged[key]
+
+    def discard(self, user, account_name):
+        """
+        drops the staged copy of an account so it isn't written, ie when a 
+        change turned out not to apply
+        """
+        self.staged.pop((user.server.id, user.id, account_name), None)
+
+    def withdraw(self, user, account_name, withdraw_method):
+        withdraw_method(self.get_account(user, account_name))
+
+    def deposit(self, user, account_name, deposit_method):
+        deposit_method(self.get_account(user, account_name))
+
+    def transfer(self, send_user, send_account_name, recv_user,
+                 recv_account_name, transfer_method):
+        transfer_method(self.get_account(send_user, send_account_name),
+                        self.get_account(recv_user, recv_account_name))
+
+    def set_storage(self, user, account_name, storage):
+        self.get_account(user, account_name)["storage"] = storage
+
+    def set_metadata(self, user, account_name, metadata):
+        self.get_account(user, account_name)["metadata"] = metadata
+
+
 class VaultClass:
-    def __init__(self, bot, vault_path):
+    InvalidTransactionException = InvalidTransactionException
+    AccountExistsExcpeption = AccountExistsExcpeption
+    NoAccountException = NoAccountException
+
+    def __init__(self, bot, backend, *, flush_interval=5, writer=None):
         """
         Initializes a "locker" of sorts which stores arbitrary items
         :param bot: discord bot object
-        :param accounts_file_path: file path to accounts json
+        :param backend: storage backend holding the accounts (see 
+        VAULT_BACKENDS)
+        :param flush_interval: seconds between backend flushes, 0 flushes on
+        every mutation
+        :param writer: PersistenceWriter doing the file io off the event
+        loop, None writes synchronously
         """
-        self.vault_path = vault_path
-        self.accounts = dataIO.load_json(self.vault_path)
+        self.backend = backend
+        self.writer = writer
         self.bot = bot
+        self.flush_interval = flush_interval
+        self._flush_task = None
+        self.indexes = {}
+        self.locks = AccountLocks()
+        if flush_interval > 0:
+            self._flush_task = bot.loop.create_task(self._flush_loop())
+
+    def add_column_index(self, name, account_name, key, dtype="int64"):
+        """
+        registers a numpy column mirroring one value of an account type per
+        server, returns the existing one if already registered under name
+        :param name: index name
+        :param account_name: account type to mirror
+        :param key: function of the account dictionary returning the value
+        :param dtype: numpy dtype of the column
+        :return: ColumnIndex
+        """
+        if numpy is None:
+            raise RuntimeError(NUMPY_MISSING)
+        if name not in self.indexes:
+            self.indexes[name] = ColumnIndex(self.backend, account_name, key,
+                                             dtype)
+        return self.indexes[name]
+
+    def add_index(self, name, account_name, key):
+        """
+        registers a sorted index over an account type, returns the existing
+        index if one is already registered under name
+        :param name: index name
+        :param account_name: account type to index
+        :param key: function of the account dictionary returning the value to
+        sort by
+        :return: AccountIndex
+        """
+        if name not in self.indexes:
+            self.indexes[name] = AccountIndex(self.backend, account_name, key)
+        return self.indexes[name]
 
     def create_account(self, user, *, account_name="", metadata={}, storage={}):
         """
@@ -51,12 +1760,12 @@ class VaultClass:
 
         server = user.server
         if not self.account_exists(user, account_name):
-            self._initialize_user_directory(user, server)
+            metadata = dict(metadata)
+            storage = dict(storage)
             metadata["created_at"] = datetime.utcnow().strftime(
                 "%Y-%m-%d %H:%M:%S")
             account = {"metadata": metadata, "storage": storage}
             self._set_user_account(user, account_name, account)
-            self._save_vault_data()
             return self.get_account(user, account_name)
         else:
             print("Account => {}.{}:{} already exists".format(server.id,
@@ -64,18 +1773,6 @@ class VaultClass:
                                                               account_name))
             raise AccountExistsExcpeption()
 
-    def _initialize_user_directory(self, user, server):
-        """
-        intiializes the dictionary for the user directory for a server
-        :param user: discord user
-        :param server: discord server
-        :return: 
-        """
-        if server.id not in self.accounts:
-            self.accounts[server.id] = {}
-        if user.id not in self.accounts[server.id]:
-            self.accounts[server.id][user.id] = {}
-
     def _set_user_account(self, user, account_name, account):
         """
         given a user, account name and account data, sets the account dictionary 
@@ -85,27 +1782,67 @@ class VaultClass:
         :param account: account data
         :return: 
         """
-        self.accounts[user.server.id][user.id][account_name] = account
+        self._write_accounts([(user.server.id, user.id, account_name,
+                               account)])
+
+    def _write_accounts(self, entries):
+        """
+        writes a batch of accounts to the backend as one unit and updates 
+        the indexes
+        :param entries: list of (server_id, user_id, account_name, account)
+        :return: 
+        """
+        if not entries:
+            return
+        self.backend.set_accounts(entries)
+        for server_id, user_id, account_name, account in entries:
+            for index in self.indexes.values():
+                if index.account_name == account_name:
+                    index.update(server_id, user_id, account)
+        self._mutated()
 
     def account_exists(self, user, account_name):
-        server = user.server
-        if self.accounts.get(server.id, {}).get(user.id, {}).get(account_name):
+        if self.backend.get_account(user.server.id, user.id, account_name):
             return True
         return False
 
+    def lock(self, *accounts):
+        """
+        usage:
+            async with vault.lock((sender, "bank"), (receiver, "bank")):
+                ...
+        serializes read-modify-write sequences that span awaits on the same
+        accounts, locks are taken in a fixed order
+        :param accounts: (discord user, account_name) pairs
+        :return: async context manager
+        """
+        return self.locks.locked([(user.server.id, user.id, account_name)
+                                  for user, account_name in accounts])
+
+    def transaction(self):
+        """
+        usage:
+            with vault.transaction() as transaction:
+                transaction.withdraw(user, "bank", withdraw_method)
+                transaction.deposit(other, "stash", deposit_method)
+        every account touched is written in a single batch on exit, or not at
+        all if the block raises
+        :return: VaultTransaction
+        """
+        return VaultTransaction(self)
+
     def withdraw(self, user, account_name, withdraw_method):
         """
         withdraws data using a withdraw method
         :param user: discord user
         :param account_name: account for user
-        :param withdraw_method: function object which carries out withdraw
+        :param withdraw_method: function object which carries out withdraw on
+        a private {"metadata", "storage"} copy of the account
         :return: 
         """
-        account = self.get_account(user, account_name)
         try:
-            withdraw_method(account)
-            self._set_account(account)
-            self._save_vault_data()
+            with self.transaction() as transaction:
+                transaction.withdraw(user, account_name, withdraw_method)
         # TODO what happens with security?
         except InvalidTransactionException as exception:
             print(exception)
@@ -115,36 +1852,33 @@ class VaultClass:
         deposits data using a deposit method
         :param user: discord user
         :param account_name: account for user
-        :param deposit_method: function object which carries out deposit
+        :param deposit_method: function object which carries out deposit on
+        a private {"metadata", "storage"} copy of the account
         :return: 
         """
-        account = self.get_account(user, account_name)
         try:
-            deposit_method(account)
-            self._set_account(account)
-            self._save_vault_data()
+            with self.transaction() as transaction:
+                transaction.deposit(user, account_name, deposit_method)
         except InvalidTransactionException as exception:
             print(exception)
 
     def transfer(self, send_user, send_account_name, recv_user,
                  recv_account_name, transfer_method):
         """
-        transfers data between accounts using transfer method
+        transfers data between accounts using transfer method, both accounts
+        are written together or not at all
         :param send_user: user to send
         :param send_account_name: account to send for user
         :param recv_user: user to recv
         :param recv_account_name: account to recv for recv user
-        :param transfer_method: method by which transfer occurs
+        :param transfer_method: method by which transfer occurs, called with
+        private copies of both accounts
         :return: 
         """
-
-        send_account = self.get_account(send_user, send_account_name)
-        recv_account = self.get_account(recv_user, recv_account_name)
         try:
-            transfer_method(send_account, recv_account)
-            self._set_account(send_account)
-            self._set_account(recv_account)
-            self._save_vault_data()
+            with self.transaction() as transaction:
+                transaction.transfer(send_user, send_account_name, recv_user,
+                                     recv_account_name, transfer_method)
         except InvalidTransactionException as exception:
             print(exception)
 
@@ -156,13 +1890,10 @@ class VaultClass:
         :param storage: storage to set
         :return: 
         """
-        account = self.get_account(user, account_name)
-        try:
-            account["storage"] = storage
-            self._set_account(account)
-            self._save_vault_data()
-        except InvalidTransactionException as exception:
-            print(exception)
+        account = self._get_raw_account(user, account_name)
+        self._set_user_account(user, account_name,
+                               {"metadata": account["metadata"],
+                                "storage": storage})
 
     def set_metadata(self, user, account_name, metadata):
         """
@@ -172,53 +1903,67 @@ class VaultClass:
         :param metadata: metadata to set
         :return: 
         """
-        account = self.get_account(user, account_name)
-        try:
-            account["metadata"] = metadata
-            self._set_account(account)
-            self._save_vault_data()
-        except InvalidTransactionException as exception:
-            print(exception)
+        account = self._get_raw_account(user, account_name)
+        self._set_user_account(user, account_name,
+                               {"metadata": metadata,
+                                "storage": account["storage"]})
 
     def clear_account(self, user, account_name):
-        self.accounts[user.server.id][user.id][account_name] = {}
-        self._save_vault_data()
+        self.backend.delete_accounts(user.server.id, user.id, account_name)
+        for index in self.indexes.values():
+            if index.account_name == account_name:
+                index.discard(user.server.id, user.id)
+        self._mutated()
 
     def clear_user_accounts(self, user):
-        self.accounts[user.server.id][user.id] = {}
-        self._save_vault_data()
+        self.backend.delete_accounts(user.server.id, user.id)
+        for index in self.indexes.values():
+            index.discard(user.server.id, user.id)
+        self._mutated()
 
-    def clear_server_accounts(self, server):
-        self.accounts[server.id] = {}
-        self._save_vault_data()
+    def clear_server_accounts(self, server, account_name=None):
+        """
+        deletes the server's accounts of one type, or of every type when 
+        account_name is None
+        :param server: discord server
+        :param account_name: account type to delete
+        :return: 
+        """
+        self.backend.delete_accounts(server.id, None, account_name)
+        for index in self.indexes.values():
+            if account_name is None or index.account_name == account_name:
+                index.drop_server(server.id)
+        self._mutated()
+
+    def import_accounts(self, entries):
+        """
+        writes accounts addressed by id rather than discord user, for cogs 
+        migrating their own storage into the vault. Accounts that already 
+        exist are left as they are
+        :param entries: list of (server_id, user_id, account_name, account)
+        :return: number of accounts imported
+        """
+        entries = [entry for entry in entries
+                   if not self.backend.get_account(*entry[:3])]
+        self._write_accounts(entries)
+        return len(entries)
 
     def get_user_accounts(self, user):
         server = user.server
-        raw_user_accounts = deepcopy(
-            self.accounts.get(server.id, {}).get(user.id, {}))
-        accounts = []
-        for account_name, account in raw_user_accounts.items():
-            account_tuple = self._create_account_tuple(server,
-                                                       user,
-                                                       account_name)
-            accounts.append(account_tuple)
-
-    def get_server_accounts(self, server):
-        raw_server_accounts = deepcopy(self.accounts.get(server.id, {}))
-        accounts = []
-        for userid_key, user_accounts in raw_server_accounts.items():
-            for account_name, account in user_accounts.items():
-                temp_user = namedtuple("temp_user", "id, server")
-                temp_user(userid_key, server)
-                account_tuple = self._create_account_tuple(server,
-                                                           temp_user,
-                                                           account_name)
-                accounts.append(account_tuple)
-        return accounts
+        raw_user_accounts = self.backend.get_user_accounts(server.id, user.id)
+        return [Account(user.id, server, account_name, account)
+                for account_name, account in raw_user_accounts.items()
+                if account]
+
+    def get_server_accounts(self, server, account_name=None):
+        return [Account(user_id, server, name, account)
+                for user_id, name, account in
+                self.backend.iter_server_accounts(server.id)
+                if account and account_name in (None, name)]
 
     def get_all_accounts(self):
         accounts = []
-        for server_id, userids in self.accounts.items():
+        for server_id in self.backend.server_ids():
             server = self.bot.get_server(server_id)
             if server is None:
                 # Servers that have since been left will be ignored
@@ -228,69 +1973,100 @@ class VaultClass:
         return accounts
 
     def get_storage(self, user, account_name):
-        account = self._get_account(user, account_name)
-        return account["storage"]
+        return self.get_account(user, account_name).storage
 
     def get_metadata(self, user, account_name):
-        account = self._get_account(user, account_name)
-        return account["metadata"]
+        return self.get_account(user, account_name).metadata
 
     def get_account(self, user, account_name):
-        return self._create_account_tuple(user.server, user, account_name)
+        """
+        given a discord user and account name, retrieves a read only view of
+        the respective account
+        :param user: discord user
+        :param account_name: user account name
+        :return: Account(userid, server, name, member, created_at, metadata,
+        storage)
+        """
+        account = self._get_raw_account(user, account_name)
+        return Account(user.id, user.server, account_name, account)
 
-    def _set_account(self, account):
+    def _mutated(self):
         """
-        sets the account data to account param for the given user (assuming 
-        account was created via namedtuple in _create_account_tuple)
-        :param account: account to set
+        called after every backend write, persists immediately when there is
+        no flush loop, otherwise the write is picked up by the next flush
         :return: 
         """
-        try:
-            userid = account["userid"]
-            server = account["server"]
-            account_name = account["account_name"]
-            self.accounts[server][userid][account_name] = account
-        except KeyError as exception:
-            print("Can't set account data: ", exception)
+        if self._flush_task is None:
+            self._save_vault_data()
 
-    def _create_account_tuple(self, server, user, account_name):
+    def _save_vault_data(self):
         """
-        given a discord user and account name, retrieves the respective account
-        from the vault as a named tuple of elements 
-        :param user: discord user
-        :param account_name: user account name
-        :return: namedtuple(userid, server, name, member, created_at)
-        """
-        account_dict = self._get_account(user, account_name)
-        account_dict["userid"] = user.id
-        account_dict["server"] = server
-        account_dict["name"] = account_name
-        account_dict["member"] = server.get_member(user.id)
-        account_dict["created_at"] = datetime.strptime(
-            account_dict["metadata"]["created_at"], "%Y-%m-%d %H:%M:%S")
-        Account = namedtuple("Account", list(account_dict.keys()))
-        return Account(**account_dict)
+        flushes pending writes to the backend's storage
+        :return: list of futures completing once the writes are on disk
+        """
+        return self.backend.flush(self.writer) or []
 
-    def _save_vault_data(self):
+    async def persist(self):
         """
-        saves current dictionary data for accounts
+        flushes now and waits until every mutation made so far is on disk, 
+        for commands that must not return before their change is durable
         :return: 
         """
-        dataIO.save_json(self.vault_path, self.accounts)
+        futures = self._save_vault_data()
+        if futures:
+            await asyncio.gather(*futures)
 
-    def _get_account(self, user, account_name):
+    async def _flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                # failures are reported by the writer and retried next time
+                await asyncio.gather(*self._save_vault_data(),
+                                     return_exceptions=True)
+        except asyncio.CancelledError:
+            pass
+
+    def stop_flushing(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def close(self):
         """
-        returns the copy of the user information in the loaded locker 
-        self.accounts.  If the user at the given user server id is not found,
-        returns a "No account exception"
-        :param user: 
-        :return: loaded json data of user information
+        stops the flush loop and persists every outstanding mutation through
+        the backend, called when the vault cog is unloaded after its writer
+        has been drained
+        :return: 
+        """
+        self.stop_flushing()
+        self.writer = None
+        self.backend.close()
+
+    def _get_raw_account(self, user, account_name):
+        """
+        returns the account dictionary stored in the vault backend without 
+        copying it, callers must not mutate it
+        :param user: discord user
+        :param account_name: user account name
+        :return: account dictionary {"metadata", "storage"}
         """
         server = user.server
-        try:
-            return deepcopy(self.accounts[server.id][user.id][account_name])
-        except KeyError as exception:
-            print("No account found: ", exception)
+        account = self.backend.get_account(server.id, user.id, account_name)
+        if not account:
+            raise NoAccountException(
+                "No account found: {}.{}:{}".format(server.id, user.id,
+                                                    account_name))
+        return account
+
+    def _get_account(self, user, account_name):
+        """
+        returns a private copy of the account for a mutation to modify, 
+        readers should use get_account which does not copy
+        :param user: discord user
+        :param account_name: user account name
+        :return: copy of account dictionary {"metadata", "storage"}
+        """
+        return deepcopy(self._get_raw_account(user, account_name))
 
     def _get_user_accounts(self, user):
         """
@@ -299,7 +2075,31 @@ class VaultClass:
         :param user: discord user
         :return: user accounts dictionary
         """
-        return self.accounts[user.server.id][user.id]
+        return self.backend.get_user_accounts(user.server.id, user.id)
+
+
+def unique_accounts(accounts, top=None, key=lambda account: account.userid):
+    """
+    keeps the first account seen for each user from an already sorted stream,
+    stopping as soon as top unique users have been found
+    :param accounts: iterable of accounts, consumed lazily
+    :param top: number of unique accounts wanted, None for all
+    :param key: function returning the identity to deduplicate on
+    :return: list of unique accounts in stream order
+    """
+    seen = set()
+    unique = []
+    if top is not None and top <= 0:
+        return unique
+    for account in accounts:
+        identity = key(account)
+        if identity in seen:
+            continue
+        seen.add(identity)
+        unique.append(account)
+        if top is not None and len(unique) >= top:
+            break
+    return unique
 
 
 def create_folder_if_none(folder_path):
@@ -335,13 +2135,104 @@ class Vault:
         self.bot = bot
         self.InvalidTransactionException = InvalidTransactionException
         self.AccountExistsExcpeption = AccountExistsExcpeption
+        self.NoAccountException = NoAccountException
+        self.Account = Account
         self.cog_list = []
+        self.vaults = []
+        self.vault_paths = OrderedDict()
+        self.vault_cogs = defaultdict(list)
+        # file path -> store, kept across reloads of the cogs using them
+        self.cooldowns = {}
+        self.settings_stores = {}
+        self.writer = PersistenceWriter(bot.loop)
+
+    def __unload(self):
+        for vault in self.vaults:
+            vault.stop_flushing()
+        # the stores save through the writer, which is drained after them
+        for cooldowns in self.cooldowns.values():
+            cooldowns.close()
+        for settings in self.settings_stores.values():
+            settings.close()
+        self.writer.close()
+        for vault in self.vaults:
+            vault.close()
 
-    def get_vault(self, folder_path, file_path, cogID):
+    def get_vault(self, folder_path, file_path, cogID, *, backend="json",
+                  flush_interval=5, **backend_options):
+        """
+        creates a vault for a cog. Cogs asking for the same file_path share
+        one vault, so they can change each other's account types in a 
+        single transaction, the first cog's backend options are used
+        :param folder_path: folder holding the vault files
+        :param file_path: file path to accounts json
+        :param cogID: name of the cog using the vault
+        :param backend: storage backend name, one of VAULT_BACKENDS
+        :param flush_interval: seconds between writes to disk
+        :param backend_options: extra keyword arguments for the backend, ie
+        max_loaded_shards for the json backend
+        :return: VaultClass
+        """
         self.cog_list.append(cogID)
+        self.vault_cogs[file_path].append(cogID)
+        if file_path in self.vault_paths:
+            return self.vault_paths[file_path]
+        create_folder_if_none(folder_path)
+        vault = VaultClass(self.bot,
+                           VAULT_BACKENDS[backend](file_path,
+                                                   **backend_options),
+                           flush_interval=flush_interval,
+                           writer=self.writer)
+        self.vaults.append(vault)
+        self.vault_paths[file_path] = vault
+        return vault
+
+    def get_cooldowns(self, folder_path, file_path, *, flush_interval=30):
+        """
+        creates a restart safe cooldown store for a cog, saved through the 
+        vault writer. Asking again for the same file_path (ie after the cog
+        was reloaded) returns the same store, so no cooldown is lost
+        :param folder_path: folder holding the cooldown file
+        :param file_path: file path to cooldowns json
+        :param flush_interval: seconds between writes to disk
+        :return: CooldownStore
+        """
+        cooldowns = self.cooldowns.get(file_path)
+        if cooldowns is not None:
+            cooldowns.start_flushing(flush_interval)
+            return cooldowns
         create_folder_if_none(folder_path)
-        create_file_if_none(file_path)
-        return VaultClass(self.bot, file_path)
+        cooldowns = CooldownStore(self.bot, file_path,
+                                  flush_interval=flush_interval,
+                                  writer=self.writer)
+        self.cooldowns[file_path] = cooldowns
+        return cooldowns
+
+    def get_settings(self, folder_path, file_path, defaults, *, save_delay=2):
+        """
+        creates a cached per server settings store for a cog, saved through
+        the vault writer. Asking again for the same file_path returns the 
+        same store with the new defaults
+        :param folder_path: folder holding the settings file
+        :param file_path: file path to settings json
+        :param defaults: {key: default value} for every setting
+        :param save_delay: seconds changes are batched before writing
+        :return: SettingsStore
+        """
+        settings = self.settings_stores.get(file_path)
+        if settings is not None:
+            settings.set_defaults(defaults)
+            return settings
+        create_folder_if_none(folder_path)
+        settings = SettingsStore(self.bot, file_path, defaults,
+                                 save_delay=save_delay, writer=self.writer)
+        self.settings_stores[file_path] = settings
+        return settings
+
+    @staticmethod
+    def unique_accounts(accounts, top=None,
+                        key=lambda account: account.userid):
+        return unique_accounts(accounts, top, key)
 
     @staticmethod
     def make_transaction_exception(user_item_dict):
@@ -353,6 +2244,41 @@ class Vault:
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
 
+    @_vault.command(pass_context=True)
+    @checks.is_owner()
+    async def lockstats(self, ctx):
+        """shows account lock contention for each vault"""
+        msg = ""
+        for file_path, vault in self.vault_paths.items():
+            cogID = ", ".join(self.vault_cogs[file_path])
+            stats = vault.locks.stats
+            msg += ("{}: {} acquired, {} contended, {:.3f}s waited "
+                    "(max {:.3f}s), {} held\n".format(
+                        cogID, stats["acquired"], stats["contended"],
+                        stats["wait_seconds"], stats["max_wait_seconds"],
+                        len(vault.locks.locks)))
+            for key, count in vault.locks.most_contended():
+                msg += "    {}: {}\n".format(".".join(key), count)
+        if msg == "":
+            msg = "No vaults in use."
+        for page in pagify(msg):
+            await self.bot.say(box(page))
+
+    @_vault.command(pass_context=True)
+    @checks.is_owner()
+    async def convert(self, ctx, source_path: str, destination_path: str):
+        """converts a vault shard snapshot between .json and .msgpack
+
+        Only convert shards of a vault that isn't loaded, or whose journal
+        has just been compacted"""
+        try:
+            users = convert_snapshot(source_path, destination_path)
+        except (OSError, ValueError, RuntimeError) as exception:
+            await self.bot.say("Conversion failed: {}".format(exception))
+        else:
+            await self.bot.say("Converted {} users from {} to {}".format(
+                users, source_path, destination_path))
+
     @_vault.command(pass_context=True, no_pm=True)
     async def listcogs(self, ctx):
         """lists cogs currently using this vault"""